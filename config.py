@@ -34,4 +34,18 @@ class Config:
     OPENWEATHER_API_KEY = ""
     OPENWEATHER_API_URL = "https://api.openweathermap.org/data/2.5/weather"
     OPENWEATHER_CALL_INTERVAL = 600
+    LIVE_UPDATES_MAX_CLIENTS = 20
+    LIVE_UPDATES_MAX_CLIENTS_PER_WORKER = 4
+    NOISE_STATS_WINDOWS = [60, 900]
+    RECENT_READINGS_HOURS = 1
+    SAVE_FLUSH_INTERVAL = 60
+    SAVE_FLUSH_SIZE = 100
+    SAVE_FSYNC = True
+    STORAGE_BACKEND = "json"
+    HARDWARE_BACKEND = "pi"
+    SIMULATED_LATENCY = 0.05
+    SIMULATED_NOISE = 1.0
+    SIMULATED_FAILURE_RATE = 0.0
+    READINGS_STATS_WINDOWS = [3600, 86400]
+    READINGS_STATS_EMA = 300
     DEBUG_LOGGING_ENABLED = False
@@ -9,34 +9,40 @@ URL: https://gitlab.com/idotj/enviroplusweb
 License: GNU
 """
 
-from flask import Flask, render_template, request, redirect, abort, jsonify
-import RPi.GPIO as GPIO
-import st7735
-import struct
-from fonts.ttf import RobotoMedium as UserFont
+from flask import Flask, Response, render_template, request, redirect, abort, jsonify
+from werkzeug.security import safe_join
 from PIL import Image, ImageDraw, ImageFont
-from pms5003 import PMS5003
-from enviroplus.noise import Noise
-from enviroplus import gas
-from bme280 import BME280
-from smbus2 import SMBus
-
-try:
-    from ltr559 import LTR559
-
-    ltr559 = LTR559()
-except ImportError:
-    import ltr559
 import logging
 import os
 import glob
+import hashlib
 import threading
 import json
+import mimetypes
+import mmap
+import posixpath
+import re
+import csv
+import io
+import queue
+import signal
+import sqlite3
+import sys
+import zlib
 import requests
-from math import ceil, floor
-from time import sleep, time, asctime, localtime
-from datetime import datetime, timedelta
+import numpy as np
+from math import ceil, exp, floor, inf, log10, nan, sqrt
+from time import time, asctime, localtime, monotonic, sleep
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
+from hardware import PiHardware, SimulatedHardware
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 print("")
 print("************************")
@@ -62,57 +68,92 @@ logging.debug(f"Initializing app with the following config:\n{vars(Config)}")
 logging.debug("Loading dictionary folder")
 language_list = glob.glob("i18n/*.json")
 languages = {}
+dashboard_pages = {}
+dashboard_pages_lock = threading.Lock()
 # App config
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)
 app.config["TEMPLATES_AUTO_RELOAD"] = True
+static_folder = os.path.join(app.root_path, "static")
+static_assets = {}
+static_assets_lock = threading.Lock()
+static_compressible = (".css", ".js", ".svg", ".ttf", ".ico", ".txt", ".webmanifest")
+static_css_url = re.compile(r"""url\(["']?([^"')]+)["']?\)""")
 app_data_folder = "enviroplusweb-data"
+readings_file_ext = ".jsonl"
+rollup_folder = os.path.join(app_data_folder, "rollups")
+readings_database_file = os.path.join(app_data_folder, "readings.db")
+rollup_tiers = {"hourly": "%Y-%m", "daily": "%Y"}
+rollup_views = {"week": "hourly", "month": "hourly", "year": "daily"}
+open_rollups = {}
+rollup_lock = threading.Lock()
+readings_cache = OrderedDict()
+readings_cache_lock = threading.Lock()
+readings_cache_max_bytes = 16 * 1024 * 1024
+readings_cache_stats = {"hits": 0, "misses": 0, "bytes": 0}
+readings_subscribers = []
+readings_subscribers_lock = threading.Lock()
+downsample_aggregates = ("mean", "minmax", "lttb")
+max_graph_points = 2000
+max_timestamp = datetime(9999, 12, 30).timestamp()
 app_main_url = "/dashboard"
 app_error_template = "error.html"
 save_readings_interval = 15
 next_save_time = 0
 idle_time = 2
 run_flag = True
+stop_event = threading.Event()
+storage_ready = threading.Event()
+startup_started_at = monotonic()
+startup_times = {}
+# "standalone" reads the sensors and serves the dashboard, "sampler" only reads
+# the sensors and publishes them to the "web" workers started from wsgi.py
+app_roles = ("standalone", "sampler", "web")
+app_role = os.environ.get("ENVIROPLUSWEB_ROLE", "standalone")
+if app_role not in app_roles:
+    logging.error(f"Unknown role {app_role}, running standalone")
+    app_role = "standalone"
+reads_sensors = app_role != "web"
+shared_state_file = os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else app_data_folder,
+    "enviroplusweb-state",
+)
+# Readings published longer ago than this are from a sampler that stopped
+shared_state_max_age = idle_time * 5
+
+
+def run_startup_phase(phase, setup, *args):
+    started_at = monotonic()
+    try:
+        return setup(*args)
+    finally:
+        startup_times[phase] = round(monotonic() - started_at, 3)
+
+
 # Sensors
 assert Config.GAS_SENSOR or not Config.PARTICULATE_SENSOR
-bus = SMBus(1)
-bme280 = BME280(i2c_dev=bus)
-pms5003 = PMS5003()
-noise = Noise()
-cpu_temps = []
+if not reads_sensors:
+    hardware = None
+elif Config.HARDWARE_BACKEND == "simulated":
+    logging.debug("Using simulated sensors, fan and LCD screen")
+    hardware = SimulatedHardware(
+        Config.SIMULATED_LATENCY, Config.SIMULATED_NOISE, Config.SIMULATED_FAILURE_RATE
+    )
+else:
+    hardware = PiHardware()
 
 
-if Config.FAN_GPIO_ENABLED:
+def setup_fan():
     logging.debug(f"Setting up GPIO fan on pin {Config.FAN_GPIO_PIN}")
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setwarnings(False)
-    GPIO.setup(Config.FAN_GPIO_PIN, GPIO.OUT)
-    pwm = GPIO.PWM(Config.FAN_GPIO_PIN, 1000)
-    pwm.start(100)
-
-
-if Config.LCD_SCREEN_ENABLED:
-    logging.debug("Setting up LCD Screen")
-    disp = st7735.ST7735(
-        port=0,
-        cs=1,
-        dc="GPIO9",
-        backlight="GPIO12",
-        rotation=270,
-        spi_speed_hz=10000000,
-    )
+    hardware.setup_fan(Config.FAN_GPIO_PIN)
 
-    disp.begin()
 
-    WIDTH = disp.width
-    HEIGHT = disp.height
+if Config.LCD_SCREEN_ENABLED and reads_sensors:
+    disp = None
 
     color_above_threshold = (255, 0, 128)
     color_below_threshold = (64, 220, 220)
     color_within_threshold = (64, 220, 64)
 
-    img = Image.new("RGB", (WIDTH, HEIGHT), color=(0, 0, 0))
-    draw = ImageDraw.Draw(img)
-
     path = os.path.dirname(os.path.realpath(__file__)) + "/static/fonts"
     smallfont = ImageFont.truetype(path + "/asap/Asap-Bold.ttf", 10)
     x_offset = 2
@@ -129,24 +170,42 @@ if Config.LCD_SCREEN_ENABLED:
 
     previous_readings = {}
 
+    def setup_lcd():
+        global disp, WIDTH, HEIGHT, img, draw
+        logging.debug("Setting up LCD Screen")
+        screen = hardware.open_display()
+        WIDTH = screen.width
+        HEIGHT = screen.height
+        img = Image.new("RGB", (WIDTH, HEIGHT), color=(0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        disp = screen
+
     def lcd_draw_readings():
         global previous_readings
+        if disp is None:
+            return
         draw.rectangle((0, 0, WIDTH, HEIGHT), (0, 0, 0))
         column_count = 2
         row_count = ceil(len(units) / column_count)
-        variables = list(current_readings.keys())
+        variables = [
+            key for key in current_readings.keys() if key not in ("time", "ts")
+        ]
         tolerance = 1.01
         if not previous_readings:
             previous_readings = current_readings.copy()
 
         for i in range(len(units)):
-            variable = variables[i + 1]
+            variable = variables[i]
             data_value = current_readings[variable]
-            last_value = previous_readings[variable]
+            last_value = previous_readings.get(variable)
+            previous_readings[variable] = data_value
 
-            if data_value is None or last_value is None:
+            if data_value is None:
                 logging.debug(f"Skipping '{variable}' because of None value")
                 continue
+            if last_value is None:
+                # First value after a missing one, nothing to compare it with
+                last_value = data_value
 
             unit = units[i]
             x = x_offset + (WIDTH // column_count) * (i // row_count)
@@ -160,29 +219,177 @@ if Config.LCD_SCREEN_ENABLED:
             else:
                 rgb = color_within_threshold
 
-            previous_readings[variable] = data_value
             draw.text((x, y), message, font=smallfont, fill=rgb)
         disp.display(img)
 
 
-def get_cpu_temperature():
-    with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-        temp = f.read()
-        temp = int(temp) / 1000.0
-    return temp
+class RollingWindow:
+    # Samples are grouped in buckets so memory doesn't grow with the sample rate,
+    # the window moves one bucket at a time and each sample costs O(1)
+    def __init__(self, seconds, buckets=60):
+        self.seconds = seconds
+        self.bucket_seconds = seconds / buckets
+        self.buckets = deque()
+        self.minimums = deque()
+        self.maximums = deque()
+        self.current = None
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.shift = None
+
+    def add(self, timestamp, value):
+        bucket_start = floor(timestamp / self.bucket_seconds) * self.bucket_seconds
+        if self.current is not None and self.current["start"] != bucket_start:
+            self.close_bucket()
+        if self.current is None:
+            self.current = {
+                "start": bucket_start,
+                "count": 0,
+                "total": 0.0,
+                "squares": 0.0,
+                "min": value,
+                "max": value,
+            }
+        if self.shift is None:
+            # Sums around the first value keep the variance precise
+            self.shift = value
+
+        shifted = value - self.shift
+        bucket = self.current
+        bucket["count"] += 1
+        bucket["total"] += shifted
+        bucket["squares"] += shifted * shifted
+        bucket["min"] = min(bucket["min"], value)
+        bucket["max"] = max(bucket["max"], value)
+        self.expire(timestamp)
+
+    def close_bucket(self):
+        bucket = self.current
+        self.current = None
+        self.buckets.append(bucket)
+        self.count += bucket["count"]
+        self.total += bucket["total"]
+        self.squares += bucket["squares"]
+        # Minimums increase and maximums decrease, the first one is the window's
+        while self.minimums and self.minimums[-1][1] >= bucket["min"]:
+            self.minimums.pop()
+        self.minimums.append((bucket["start"], bucket["min"]))
+        while self.maximums and self.maximums[-1][1] <= bucket["max"]:
+            self.maximums.pop()
+        self.maximums.append((bucket["start"], bucket["max"]))
+
+    def expire(self, now):
+        cutoff = now - self.seconds
+        if self.current is not None and self.current["start"] <= cutoff:
+            self.close_bucket()
+        while self.buckets and self.buckets[0]["start"] <= cutoff:
+            bucket = self.buckets.popleft()
+            self.count -= bucket["count"]
+            self.total -= bucket["total"]
+            self.squares -= bucket["squares"]
+        if not self.buckets:
+            self.count = 0
+            self.total = 0.0
+            self.squares = 0.0
+        while self.minimums and self.minimums[0][0] <= cutoff:
+            self.minimums.popleft()
+        while self.maximums and self.maximums[0][0] <= cutoff:
+            self.maximums.popleft()
+
+    def get_mean(self):
+        count = self.count
+        total = self.total
+        if self.current is not None:
+            count += self.current["count"]
+            total += self.current["total"]
+        if not count:
+            return None
+        return self.shift + total / count
+
+    def get_stats(self, now):
+        self.expire(now)
+        count = self.count
+        total = self.total
+        squares = self.squares
+        minimums = [self.minimums[0][1]] if self.minimums else []
+        maximums = [self.maximums[0][1]] if self.maximums else []
+        if self.current is not None:
+            count += self.current["count"]
+            total += self.current["total"]
+            squares += self.current["squares"]
+            minimums.append(self.current["min"])
+            maximums.append(self.current["max"])
+        if not count:
+            return None
+        mean = total / count
+        return {
+            "mean": round(self.shift + mean, 2),
+            "min": min(minimums),
+            "max": max(maximums),
+            "stdev": round(sqrt(max(squares / count - mean * mean, 0)), 2),
+            "count": count,
+        }
 
 
-if Config.TEMP_CPU_COMPENSATION:
-    cpu_temps = [get_cpu_temperature()] * 5
+class ReadingsStats:
+    def __init__(self, windows, ema_seconds):
+        self.windows = windows
+        self.ema_seconds = ema_seconds
+        self.fields = {}
+        self.lock = threading.Lock()
+
+    def add(self, readings):
+        timestamp = readings["ts"]
+        with self.lock:
+            for field, value in readings.items():
+                if field in ("time", "ts") or value is None:
+                    continue
+                stats = self.fields.get(field)
+                if stats is None:
+                    stats = {
+                        "ema": value,
+                        "updated_at": timestamp,
+                        "windows": [RollingWindow(seconds) for seconds in self.windows],
+                    }
+                    self.fields[field] = stats
+                else:
+                    # Each sample weighs by the time since the previous one
+                    elapsed = timestamp - stats["updated_at"]
+                    weight = 1 - exp(-elapsed / self.ema_seconds)
+                    stats["ema"] += weight * (value - stats["ema"])
+                    stats["updated_at"] = timestamp
+                for window in stats["windows"]:
+                    window.add(timestamp, value)
+
+    def get_stats(self):
+        now = time()
+        with self.lock:
+            return {
+                field: {
+                    "ema": round(stats["ema"], 2),
+                    **{
+                        str(window.seconds): window.get_stats(now)
+                        for window in stats["windows"]
+                    },
+                }
+                for field, stats in self.fields.items()
+            }
+
+
+# The CPU temperature is averaged over the last 5 readings of the BME280
+cpu_temperatures = RollingWindow(10, 5)
+
+
+def setup_cpu_temperature():
+    cpu_temperatures.add(time(), hardware.read_cpu_temperature())
 
 
 def get_temperature_readings():
-    global cpu_temps
-    raw_temp = bme280.get_temperature()
+    raw_temp = hardware.read_temperature()
     if Config.TEMP_CPU_COMPENSATION:
-        cpu_temp = get_cpu_temperature()
-        cpu_temps = cpu_temps[1:] + [cpu_temp]
-        avg_cpu_temp = sum(cpu_temps) / float(len(cpu_temps))
+        cpu_temperatures.add(time(), hardware.read_cpu_temperature())
+        avg_cpu_temp = cpu_temperatures.get_mean()
         temperature_scaled = raw_temp - (
             (avg_cpu_temp - raw_temp) / Config.TEMP_COMPENSATION_FACTOR
         )
@@ -203,13 +410,13 @@ def get_temperature_readings():
 
 
 def get_humidity_readings():
-    raw_humi = bme280.get_humidity()
+    raw_humi = hardware.read_humidity()
     humidity = raw_humi * Config.HUMI_COMPENSATION_FACTOR
     return {"humi": round(humidity, 1)}
 
 
 def get_pressure_readings():
-    raw_pressure = bme280.get_pressure()
+    raw_pressure = hardware.read_pressure()
     is_system_metric = Config.SYSTEM_UNITS == "metric"
     unit_factor = 1 if is_system_metric else 0.02953
     pressure = raw_pressure * unit_factor + Config.PRES_COMPENSATION_FACTOR
@@ -217,13 +424,13 @@ def get_pressure_readings():
 
 
 def get_light_readings():
-    lux = ltr559.get_lux()
+    lux = hardware.read_lux()
     return {"lux": round(lux)}
 
 
-def fetch_weather_data(url):
+def fetch_weather_data(url, session=requests):
     try:
-        response = requests.get(url, timeout=5)
+        response = session.get(url, timeout=5)
 
         if response.status_code == 200:
             return response.json()
@@ -246,33 +453,66 @@ def fetch_weather_data(url):
         return {"error": f"An unexpected error occurred: {e}"}
 
 
-if Config.OPENWEATHER_ENABLED:
-    openweather_url = f"{Config.OPENWEATHER_API_URL}?lat={Config.LOCATION_LATITUDE}&lon={Config.LOCATION_LONGITUDE}&appid={Config.OPENWEATHER_API_KEY}&units={Config.SYSTEM_UNITS}"
-    openweather_data = []
+class WeatherRefresher:
+    def __init__(self, url, interval, retry_delay=30, session=None):
+        self.url = url
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.session = session or requests.Session()
+        self.data = None
+        self.updated_at = None
+        self.failures = 0
+        self.failures_total = 0
+        self.thread = threading.Thread(target=self.run, name="weather")
+        self.thread.daemon = True
+
+    def refresh(self):
+        data = fetch_weather_data(self.url, self.session)
+        if "error" in data:
+            self.failures += 1
+            self.failures_total += 1
+            return False
+        self.data = data
+        self.updated_at = monotonic()
+        self.failures = 0
+        return True
+
+    def run(self):
+        while run_flag:
+            if self.refresh():
+                delay = self.interval
+            else:
+                # Back off on errors, but never wait longer than a normal refresh
+                delay = min(self.retry_delay * 2 ** (self.failures - 1), self.interval)
+            if stop_event.wait(delay):
+                break
 
+    def get_age(self):
+        if self.updated_at is None:
+            return None
+        return round(monotonic() - self.updated_at, 1)
 
-def get_openweather_readings():
-    global openweather_data
+    def is_warming_up(self):
+        return self.updated_at is None and self.failures_total == 0
 
-    if not hasattr(get_openweather_readings, "last_call_time"):
-        get_openweather_readings.last_call_time = 0
-        openweather_data = fetch_weather_data(openweather_url)
-        return openweather_data
+    def get_data(self):
+        # Keep serving the last good payload while the next refreshes fail
+        age = self.get_age()
+        if age is None or age > self.interval * 3:
+            return None
+        return self.data
 
-    if (
-        time() - get_openweather_readings.last_call_time
-        >= Config.OPENWEATHER_CALL_INTERVAL
-    ):
-        get_openweather_readings.last_call_time = time()
-        openweather_data = fetch_weather_data(openweather_url)
-        return openweather_data
-    else:
-        return openweather_data
+
+if Config.OPENWEATHER_ENABLED:
+    openweather_url = f"{Config.OPENWEATHER_API_URL}?lat={Config.LOCATION_LATITUDE}&lon={Config.LOCATION_LONGITUDE}&appid={Config.OPENWEATHER_API_KEY}&units={Config.SYSTEM_UNITS}"
+    weather_refresher = WeatherRefresher(
+        openweather_url, Config.OPENWEATHER_CALL_INTERVAL
+    )
 
 
 def get_wind_readings():
-    data = get_openweather_readings()
-    if "error" in data:
+    data = weather_refresher.get_data()
+    if data is None:
         wind_direction = None
         wind_speed = None
     else:
@@ -294,8 +534,153 @@ def get_wind_readings():
     }
 
 
+class NoiseWindow:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = deque()
+        self.peaks = deque()
+        self.amp_sum = 0.0
+        self.energy_sum = 0.0
+
+    def add(self, timestamp, amp, energy):
+        self.samples.append((timestamp, amp, energy))
+        self.amp_sum += amp
+        self.energy_sum += energy
+        # Peaks are kept in decreasing order, the first one is the window peak
+        while self.peaks and self.peaks[-1][1] <= amp:
+            self.peaks.pop()
+        self.peaks.append((timestamp, amp))
+
+        cutoff = timestamp - self.seconds
+        while self.samples[0][0] <= cutoff:
+            _, old_amp, old_energy = self.samples.popleft()
+            self.amp_sum -= old_amp
+            self.energy_sum -= old_energy
+        while self.peaks[0][0] <= cutoff:
+            self.peaks.popleft()
+
+    def get_stats(self):
+        count = len(self.samples)
+        if not count:
+            return None
+        energy = self.energy_sum / count
+        return {
+            "mean": round(self.amp_sum / count, 2),
+            "peak": round(self.peaks[0][1], 2),
+            "leq": round(10 * log10(energy), 1) if energy > 0 else None,
+        }
+
+
+class NoiseAnalyzer:
+    def __init__(self, sample_rate, duration, windows, buffer_seconds=4):
+        self.sample_rate = sample_rate
+        self.duration = duration
+        self.frame_size = int(sample_rate * duration)
+        self.buffer = np.zeros(int(sample_rate * buffer_seconds))
+        self.written = 0
+        self.analysed = 0
+        self.buffer_lock = threading.Lock()
+        self.windows = [NoiseWindow(seconds) for seconds in windows]
+        self.stats_lock = threading.Lock()
+        self.profile = None
+        self.stream = None
+        self.thread = threading.Thread(target=self.run, name="noise")
+        self.thread.daemon = True
+
+    def start(self):
+        try:
+            self.stream = hardware.open_microphone(self.sample_rate, self.capture)
+            self.stream.start()
+        except Exception as e:
+            logging.error(f"Unable to start noise capture, sampling on demand: {e}")
+            self.stream = None
+            return
+        self.thread.start()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+
+    def capture(self, indata, frames, time_info, status):
+        samples = indata[:, 0]
+        with self.buffer_lock:
+            start = self.written % len(self.buffer)
+            split = min(frames, len(self.buffer) - start)
+            self.buffer[start : start + split] = samples[:split]
+            self.buffer[: frames - split] = samples[split:]
+            self.written += frames
+
+    def get_frames(self):
+        with self.buffer_lock:
+            # Samples overwritten before being analysed are skipped
+            self.analysed = max(self.analysed, self.written - len(self.buffer))
+            count = (self.written - self.analysed) // self.frame_size
+            if not count:
+                return None
+            indexes = self.analysed + np.arange(count * self.frame_size)
+            frames = self.buffer[indexes % len(self.buffer)]
+            self.analysed += count * self.frame_size
+        return frames.reshape(count, self.frame_size)
+
+    def analyse(self, frames, noise_floor=100, low=0.12, mid=0.36):
+        # Same bands as Noise.get_noise_profile(), for every frame at once
+        magnitude = np.abs(np.fft.rfft(frames, n=self.sample_rate, axis=1))
+        sample_count = (self.sample_rate // 2) - noise_floor
+        mid_start = noise_floor + int(sample_count * low)
+        high_start = mid_start + int(sample_count * mid)
+        noise_ceiling = high_start + int(sample_count * (1.0 - low - mid))
+
+        amp_low = magnitude[:, noise_floor:mid_start].mean(axis=1)
+        amp_mid = magnitude[:, mid_start:high_start].mean(axis=1)
+        amp_high = magnitude[:, high_start:noise_ceiling].mean(axis=1)
+        amp_total = (amp_low + amp_mid + amp_high) / 3.0
+        energy = np.mean(frames**2, axis=1)
+
+        now = monotonic()
+        with self.stats_lock:
+            self.profile = tuple(
+                float(band[-1]) for band in (amp_low, amp_mid, amp_high, amp_total)
+            )
+            for i, (amp, frame_energy) in enumerate(zip(amp_total, energy)):
+                frame_time = now - (len(frames) - 1 - i) * self.duration
+                for window in self.windows:
+                    window.add(frame_time, amp * 64, frame_energy)
+
+    def run(self):
+        next_tick = monotonic()
+        while run_flag:
+            frames = self.get_frames()
+            if frames is not None:
+                self.analyse(frames)
+            next_tick = get_next_tick(next_tick, self.duration)
+            if stop_event.wait(max(next_tick - monotonic(), 0)):
+                break
+
+    def get_profile(self):
+        with self.stats_lock:
+            return self.profile
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {str(window.seconds): window.get_stats() for window in self.windows}
+
+
+if reads_sensors:
+    noise_analyzer = NoiseAnalyzer(
+        hardware.sample_rate, hardware.duration, Config.NOISE_STATS_WINDOWS
+    )
+
+
 def get_noise_readings():
-    low, mid, high, amp = noise.get_noise_profile()
+    if noise_analyzer.stream is not None:
+        profile = noise_analyzer.get_profile()
+        if profile is None:
+            logging.debug("Waiting for the first noise analysis")
+            return dict.fromkeys(["high", "mid", "low", "amp"])
+        low, mid, high, amp = profile
+    else:
+        low, mid, high, amp = hardware.read_noise_profile()
     low *= 128
     mid *= 128
     high *= 128
@@ -309,10 +694,10 @@ def get_noise_readings():
 
 
 def get_gas_readings():
-    gases = gas.read_all()
-    oxi = round(gases.oxidising / 1000, 1)
-    red = round(gases.reducing / 1000)
-    nh3 = round(gases.nh3 / 1000)
+    oxidising, reducing, nh3 = hardware.read_gas()
+    oxi = round(oxidising / 1000, 1)
+    red = round(reducing / 1000)
+    nh3 = round(nh3 / 1000)
     return {
         "oxi": oxi,
         "red": red,
@@ -321,19 +706,13 @@ def get_gas_readings():
 
 
 def get_particles_readings():
-    while True:
-        try:
-            particles = pms5003.read()
-            break
-        except (RuntimeError, struct.error) as e:
-            logging.error("Particle read failed: %s - %s", type(e).__name__, str(e))
-            if not run_flag:
-                raise e
-            pms5003.reset()
-            sleep(30)
-    pm1 = particles.pm_ug_per_m3(1.0)
-    pm25 = particles.pm_ug_per_m3(2.5)
-    pm10 = particles.pm_ug_per_m3(10)
+    try:
+        pm1, pm25, pm10 = hardware.read_particles()
+    except RuntimeError as e:
+        logging.error("Particle read failed: %s - %s", type(e).__name__, str(e))
+        # The particles task retries after its retry delay
+        hardware.reset_particles()
+        raise e
 
     return {
         "pm1": pm1,
@@ -342,63 +721,854 @@ def get_particles_readings():
     }
 
 
-def get_current_readings():
-    readings = {"time": asctime(localtime(time()))}
-    readings.update(get_temperature_readings())
+def get_bme280_readings():
+    readings = get_temperature_readings()
     readings.update(get_humidity_readings())
     readings.update(get_pressure_readings())
-    readings.update(get_light_readings())
-    readings.update(get_noise_readings())
+    return readings
+
+
+def get_next_tick(previous_tick, interval):
+    # Keep a fixed cadence, skipping the ticks missed by a slow iteration
+    missed = max(0, floor((monotonic() - previous_tick) / interval))
+    return previous_tick + (missed + 1) * interval
+
+
+class Summary:
+    # Updated without a lock, most summaries have a single writer thread and a
+    # rare lost observation from concurrent /graph requests is fine for metrics
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+
+
+loop_period = Summary()
+loop_jitter = Summary()
+lcd_draw_time = Summary()
+graph_times = {
+    view: Summary() for view in ("hour", "day", "week", "month", "year", "range")
+}
+
+
+class SensorTask:
+    def __init__(self, name, read, fields, interval, timeout, retry_delay=None):
+        self.name = name
+        self.read = read
+        self.fields = fields
+        self.interval = interval
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.readings = dict.fromkeys(fields)
+        self.updated_at = None
+        self.failures = 0
+        self.overruns = 0
+        self.read_time = Summary()
+        self.thread = threading.Thread(target=self.run, name=f"sensor-{name}")
+        self.thread.daemon = True
+
+    def update(self):
+        started_at = monotonic()
+        try:
+            readings = self.read()
+        except Exception as e:
+            self.read_time.observe(monotonic() - started_at)
+            self.failures += 1
+            logging.error(f"Error reading '{self.name}': {type(e).__name__} - {e}")
+            return False
+
+        duration = monotonic() - started_at
+        self.read_time.observe(duration)
+        if duration > self.timeout:
+            self.overruns += 1
+            logging.debug(
+                f"Reading '{self.name}' took {duration:.2f}s "
+                f"(deadline {self.timeout}s)"
+            )
+        self.readings = readings
+        self.updated_at = monotonic()
+        return True
+
+    def run(self):
+        next_tick = monotonic()
+        while run_flag:
+            if not self.update() and self.retry_delay:
+                next_tick = monotonic() + self.retry_delay
+            else:
+                next_tick = get_next_tick(next_tick, self.interval)
+            if stop_event.wait(max(next_tick - monotonic(), 0)):
+                break
+
+    def get_age(self):
+        if self.updated_at is None:
+            return None
+        return round(monotonic() - self.updated_at, 1)
+
+    def is_warming_up(self):
+        return self.updated_at is None and self.failures == 0
+
+    def get_readings(self):
+        # Serve the last good readings until a few reads in a row are missed
+        age = self.get_age()
+        if age is None or age > self.interval * 3 + self.timeout:
+            return dict.fromkeys(self.fields)
+        return self.readings
+
+
+sensor_tasks = [
+    SensorTask("bme280", get_bme280_readings, ["temp", "humi", "pres"], 2, 1),
+    SensorTask("light", get_light_readings, ["lux"], 1, 1),
+    SensorTask("noise", get_noise_readings, ["high", "mid", "low", "amp"], 1, 2),
+]
+
+if Config.GAS_SENSOR:
+    sensor_tasks.append(
+        SensorTask("gas", get_gas_readings, ["oxi", "red", "nh3"], 2, 1)
+    )
+
+if Config.PARTICULATE_SENSOR:
+    sensor_tasks.append(
+        SensorTask(
+            "particles", get_particles_readings, ["pm1", "pm25", "pm10"], 2, 5, 30
+        )
+    )
+
+
+def get_current_readings():
+    now = time()
+    readings = {"time": asctime(localtime(now)), "ts": int(now)}
+    for task in sensor_tasks:
+        readings.update(task.get_readings())
 
     if Config.OPENWEATHER_ENABLED:
         readings.update(get_wind_readings())
 
-    if Config.GAS_SENSOR:
-        readings.update(get_gas_readings())
+    return readings
 
-    if Config.PARTICULATE_SENSOR:
-        readings.update(get_particles_readings())
 
-    return readings
+def get_readings_age():
+    readings_age = {task.name: task.get_age() for task in sensor_tasks}
+    if Config.OPENWEATHER_ENABLED:
+        readings_age["weather"] = weather_refresher.get_age()
+    return readings_age
+
+
+def get_live_readings():
+    if app_role == "web":
+        snapshot = read_state_snapshot()
+        if snapshot is not None:
+            return snapshot["readings"]
+    return {
+        **current_readings,
+        "age": get_readings_age(),
+        "warming_up": is_warming_up(),
+    }
+
+
+def is_warming_up():
+    # Until every sensor has been read once the dashboard shows placeholders
+    tasks = sensor_tasks
+    if Config.OPENWEATHER_ENABLED:
+        tasks = tasks + [weather_refresher]
+    return any(task.is_warming_up() for task in tasks)
+
+
+def get_readings_stats():
+    if app_role == "web":
+        snapshot = read_state_snapshot()
+        return snapshot["stats"] if snapshot is not None else {}
+    return readings_stats.get_stats()
+
+
+def get_noise_stats():
+    if app_role == "web":
+        snapshot = read_state_snapshot()
+        return snapshot["noise"] if snapshot is not None else {}
+    return noise_analyzer.get_stats()
+
+
+class ReadingsRingBuffer:
+    # Readers give up if the writer keeps the sequence number odd, for example
+    # when another process died in the middle of an append
+    read_retries = 100
+
+    def __init__(self, fields, size, buffer=None):
+        self.fields = fields
+        self.size = size
+        if buffer is None:
+            buffer = bytearray(self.get_buffer_size(len(fields), size))
+            self.reset(buffer)
+        # Sequence number and count first, then one column per field, all in a
+        # buffer that can be shared with other processes
+        self.header = np.ndarray(2, np.int64, buffer)
+        self.timestamps = np.ndarray(size, np.float64, buffer, offset=16)
+        self.columns = {
+            field: np.ndarray(size, np.float64, buffer, offset=16 + 8 * size * i)
+            for i, field in enumerate(fields, start=1)
+        }
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_buffer_size(field_count, size):
+        return 16 + 8 * size * (field_count + 1)
+
+    @staticmethod
+    def reset(buffer):
+        buffer[:16] = bytes(16)
+        np.ndarray((len(buffer) - 16) // 8, np.float64, buffer, offset=16).fill(nan)
+
+    def append(self, readings):
+        with self.lock:
+            # An odd sequence number tells readers a write is in progress
+            self.header[0] += 1
+            index = self.header[1] % self.size
+            self.timestamps[index] = readings["ts"]
+            for field, column in self.columns.items():
+                value = readings.get(field)
+                column[index] = nan if value is None else value
+            self.header[1] += 1
+            self.header[0] += 1
+
+    def get_columns(self):
+        for _ in range(self.read_retries):
+            with self.lock:
+                sequence = int(self.header[0])
+                if sequence % 2 == 0:
+                    count = int(self.header[1])
+                    stored = min(count, self.size)
+                    order = np.arange(count - stored, count) % self.size
+                    timestamps = self.timestamps[order]
+                    columns = {
+                        field: column[order] for field, column in self.columns.items()
+                    }
+                    if self.header[0] == sequence:
+                        return timestamps, columns
+            sleep(0.001)
+        logging.warning("Recent readings are still being written, skipping them")
+        return np.empty(0), {field: np.empty(0) for field in self.columns}
+
+    def get_oldest_timestamp(self):
+        timestamps, _ = self.get_columns()
+        if not len(timestamps):
+            return None
+        return float(timestamps[0])
+
+    def get_rows(self, since=0, until=inf):
+        timestamps, columns = self.get_columns()
+        recent = (timestamps >= since) & (timestamps <= until)
+        rows = [
+            {"time": asctime(localtime(timestamp)), "ts": int(timestamp)}
+            for timestamp in timestamps[recent].tolist()
+        ]
+        for field, column in columns.items():
+            for row, value in zip(rows, column[recent].tolist()):
+                row[field] = value if value == value else None
+        return rows
+
+
+class SharedState:
+    # Layout version, snapshot sequence, snapshot length and requested fan speed,
+    # then the latest snapshot as JSON and the recent readings
+    version = 1
+    header_size = 32
+    snapshot_size = 256 * 1024
+    read_retries = 100
+
+    def __init__(self, file_path, fields, size):
+        self.file_path = file_path
+        self.fields = fields
+        self.size = size
+        self.file_size = (
+            self.header_size
+            + self.snapshot_size
+            + ReadingsRingBuffer.get_buffer_size(len(fields), size)
+        )
+        self.memory = None
+        self.header = None
+        self.recent_readings = None
+        self.cached = (None, None)
+        self.lock = threading.Lock()
+
+    def map(self, fd):
+        self.memory = mmap.mmap(fd, self.file_size)
+        self.header = np.ndarray(4, np.int64, self.memory)
+        self.recent_readings = ReadingsRingBuffer(
+            self.fields,
+            self.size,
+            memoryview(self.memory)[self.header_size + self.snapshot_size :],
+        )
+
+    def create(self):
+        fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, self.file_size)
+            self.map(fd)
+        finally:
+            os.close(fd)
+        ReadingsRingBuffer.reset(
+            memoryview(self.memory)[self.header_size + self.snapshot_size :]
+        )
+        self.header[:] = [self.version, 0, 0, -1]
+
+    def attach(self):
+        try:
+            fd = os.open(self.file_path, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            if os.fstat(fd).st_size != self.file_size:
+                logging.error(
+                    f"{self.file_path} doesn't match this config, "
+                    "restart the sampler after changing it"
+                )
+                return False
+            self.map(fd)
+        finally:
+            os.close(fd)
+        logging.debug(f"Attached to the sampler state in {self.file_path}")
+        return True
+
+    def publish(self, snapshot):
+        data = json.dumps(snapshot, separators=(",", ":")).encode("utf-8")
+        if len(data) > self.snapshot_size:
+            logging.error(f"Snapshot of {len(data)} bytes is too big to publish")
+            return
+        with self.lock:
+            # An odd sequence number tells readers a write is in progress
+            self.header[1] += 1
+            self.memory[self.header_size : self.header_size + len(data)] = data
+            self.header[2] = len(data)
+            self.header[1] += 1
+
+    def read(self):
+        if self.memory is None and not self.attach():
+            return None
+        for _ in range(self.read_retries):
+            sequence = int(self.header[1])
+            cached_sequence, cached_snapshot = self.cached
+            if sequence == cached_sequence:
+                return cached_snapshot
+            if sequence % 2 == 0:
+                length = int(self.header[2])
+                data = self.memory[self.header_size : self.header_size + length]
+                if self.header[1] == sequence:
+                    break
+            sleep(0.001)
+        else:
+            # Remember the torn snapshot so the next reads don't wait for it again
+            logging.warning("The sampler stopped in the middle of publishing")
+            self.cached = (sequence, None)
+            return None
+
+        snapshot = json.loads(data) if data else None
+        self.cached = (sequence, snapshot)
+        return snapshot
+
+    def request_fan_speed(self, duty_cycle):
+        if self.memory is None and not self.attach():
+            return
+        self.header[3] = duty_cycle
+
+    def take_fan_speed(self):
+        duty_cycle = int(self.header[3])
+        if duty_cycle >= 0:
+            self.header[3] = -1
+            return duty_cycle
+        return None
 
 
 current_readings = get_current_readings()
+readings_stats = ReadingsStats(Config.READINGS_STATS_WINDOWS, Config.READINGS_STATS_EMA)
+recent_readings_fields = [
+    field for field in current_readings if field not in ("time", "ts")
+]
+recent_readings_size = int(Config.RECENT_READINGS_HOURS * 3600 / idle_time)
+if app_role == "standalone":
+    shared_state = None
+    recent_readings = ReadingsRingBuffer(recent_readings_fields, recent_readings_size)
+else:
+    shared_state = SharedState(
+        shared_state_file, recent_readings_fields, recent_readings_size
+    )
+    # Replaced by the shared buffer once the sampler's state is created or found
+    recent_readings = ReadingsRingBuffer(recent_readings_fields, 1)
+
+
+def open_shared_state():
+    global recent_readings
+    if app_role == "sampler":
+        shared_state.create()
+    elif not shared_state.attach():
+        return False
+    recent_readings = shared_state.recent_readings
+    return True
+
+
+def read_state_snapshot():
+    if shared_state.memory is None and not open_shared_state():
+        return None
+    snapshot = shared_state.read()
+    # A sampler that stopped publishing leaves its last readings behind
+    if snapshot is None or time() - snapshot["published"] > shared_state_max_age:
+        return None
+    return snapshot
+
+
+def get_state_snapshot():
+    with rollup_lock:
+        rollups = {
+            tier: summarize_rollup(rollup) for tier, rollup in open_rollups.items()
+        }
+    return {
+        "published": time(),
+        "readings": get_live_readings(),
+        "noise": noise_analyzer.get_stats(),
+        "stats": readings_stats.get_stats(),
+        "rollups": rollups,
+        "pending": readings_storage.writer.get_pending(),
+        "metrics": format_metrics(get_sensor_metrics()),
+    }
+
+
+def watch_shared_state():
+    # Each web worker forwards the sampler's new readings to its own live clients
+    last_published = None
+    while not stop_event.wait(idle_time / 4):
+        snapshot = read_state_snapshot()
+        published = snapshot["published"] if snapshot is not None else None
+        if published != last_published:
+            last_published = published
+            # Once the sampler stops they get the placeholders of get_live_readings
+            publish_readings(get_live_readings())
 
 
 def update_readings():
     global current_readings
     current_readings = get_current_readings()
+    recent_readings.append(current_readings)
+    readings_stats.add(current_readings)
+    if shared_state is not None:
+        shared_state.publish(get_state_snapshot())
+        fan_speed = shared_state.take_fan_speed()
+        if fan_speed is not None and Config.FAN_GPIO_ENABLED:
+            hardware.set_fan_speed(fan_speed)
+    publish_readings(get_live_readings())
     if Config.LCD_SCREEN_ENABLED:
+        started_at = monotonic()
         lcd_draw_readings()
+        lcd_draw_time.observe(monotonic() - started_at)
 
 
-def save_readings_file():
-    current_date_str = datetime.now().strftime("%Y-%m-%d")
-    file_path = os.path.join(app_data_folder, f"{current_date_str}.json")
+def format_readings_event(readings):
+    return f"data: {json.dumps(readings, separators=(',', ':'))}\n\n"
 
-    try:
-        if os.path.exists(file_path):
-            with open(file_path, "r+", encoding="utf-8") as f:
+
+def publish_readings(readings):
+    with readings_subscribers_lock:
+        if not readings_subscribers:
+            return
+        message = format_readings_event(readings)
+        for subscriber in readings_subscribers:
+            # A slow browser only gets the latest readings, never a backlog
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            subscriber.put_nowait(message)
+
+
+def get_readings_file_path(file_date):
+    return os.path.join(
+        app_data_folder, f"{file_date.strftime('%Y-%m-%d')}{readings_file_ext}"
+    )
+
+
+def format_readings_records(records):
+    return "".join(
+        json.dumps(record, separators=(",", ":")) + "\n" for record in records
+    ).encode("utf-8")
+
+
+def append_readings_records(file_path, records, sync=True):
+    data = format_readings_records(records)
+    with open(file_path, "a+b") as f:
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                # A previous append was cut short, start the records on a new line
+                logging.error(f"⚠️ Warning: Truncated record detected in {file_path}")
+                data = b"\n" + data
+        f.write(data)
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+    return len(data)
+
+
+def write_readings_file_atomic(file_path, records, sync=True):
+    temp_path = file_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(format_readings_records(records))
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+
+class ReadingsWriter:
+    def __init__(self, append, flush_interval, flush_size):
+        self.append = append
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.running = True
+        self.pending = []
+        self.writing = []
+        self.write_time = Summary()
+        self.records_written = 0
+        self.bytes_written = 0
+        self.errors = 0
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="writer")
+
+    def write(self, target, record):
+        with self.condition:
+            self.pending.append((target, record))
+            if len(self.pending) >= self.flush_size:
+                self.condition.notify()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.condition:
+                pending, self.pending = self.pending, []
+                self.writing = pending
+
+            # One write per target, records keep their order
+            batches = {}
+            for target, record in pending:
+                batches.setdefault(target, []).append(record)
+            for target, records in batches.items():
+                started_at = monotonic()
                 try:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        data.append(current_readings)
-                    else:
-                        data = [current_readings]
-                except json.JSONDecodeError:
+                    size = self.append(target, records)
+                except Exception as e:
+                    self.errors += 1
                     logging.error(
-                        f"⚠️ Warning: Corrupt file detected, resetting {file_path}"
+                        f"Error saving {len(records)} records to {target}: {e}"
                     )
-                    data = [current_readings]
+                    continue
+                self.write_time.observe(monotonic() - started_at)
+                self.records_written += len(records)
+                self.bytes_written += size or 0
+
+            with self.condition:
+                self.writing = []
+
+    def get_pending(self):
+        # Records not on disk yet, readers add them to what they load
+        batches = {}
+        with self.condition:
+            for target, record in self.writing + self.pending:
+                batches.setdefault(target, []).append(record)
+        return batches
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: len(self.pending) >= self.flush_size or not self.running,
+                    self.flush_interval,
+                )
+            self.flush()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.flush()
+
+
+def iter_readings_file(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.error(f"Skipping corrupt record {file_path}:{line_number}")
 
-                f.seek(0)
-                json.dump(data, f, indent=4)
-                f.truncate()
-        else:
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump([current_readings], f, indent=4)
 
-        logging.debug(f"Readings saved at {datetime.now().strftime('%H:%M')}")
+def read_readings_file(file_path):
+    return list(iter_readings_file(file_path))
+
+
+def get_readings_timestamp(entry):
+    timestamp = entry.get("ts")
+    if timestamp is None:
+        # Older readings only have the local time string
+        reading_time = datetime.strptime(entry["time"], "%a %b %d %H:%M:%S %Y")
+        timestamp = int(reading_time.timestamp())
+    return timestamp
+
+
+def estimate_readings_size(readings):
+    size = sys.getsizeof(readings)
+    for timestamp, entry in readings:
+        size += sys.getsizeof(timestamp) + sys.getsizeof(entry)
+        size += sum(sys.getsizeof(value) for value in entry.values())
+    return size
+
+
+def load_readings_file(file_path):
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return []
+
+    # Only today's files change, any other file is served from memory once parsed
+    version = (stat.st_mtime_ns, stat.st_size)
+    with readings_cache_lock:
+        cached = readings_cache.get(file_path)
+        if cached is not None and cached["version"] == version:
+            readings_cache.move_to_end(file_path)
+            readings_cache_stats["hits"] += 1
+            return cached["readings"]
+        readings_cache_stats["misses"] += 1
+
+    readings = []
+    for entry in read_readings_file(file_path):
+        try:
+            entry["ts"] = get_readings_timestamp(entry)
+            readings.append((entry["ts"], entry))
+        except (KeyError, TypeError, ValueError):
+            logging.error(f"Skipping record without valid time in {file_path}")
+    size = estimate_readings_size(readings)
+
+    with readings_cache_lock:
+        previous = readings_cache.pop(file_path, None)
+        if previous is not None:
+            readings_cache_stats["bytes"] -= previous["size"]
+        if size <= readings_cache_max_bytes:
+            readings_cache[file_path] = {
+                "version": version,
+                "readings": readings,
+                "size": size,
+            }
+            readings_cache_stats["bytes"] += size
+        while readings_cache_stats["bytes"] > readings_cache_max_bytes:
+            _, evicted = readings_cache.popitem(last=False)
+            readings_cache_stats["bytes"] -= evicted["size"]
+
+    return readings
+
+
+def get_readings_cache_stats():
+    with readings_cache_lock:
+        return {
+            **readings_cache_stats,
+            "files": len(readings_cache),
+            "max_bytes": readings_cache_max_bytes,
+        }
+
+
+def get_rollup_bucket_start(tier, reading_time):
+    if tier == "hourly":
+        return reading_time.replace(minute=0, second=0, microsecond=0)
+    return reading_time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_rollup_file_path(tier, bucket_start):
+    period = bucket_start.strftime(rollup_tiers[tier])
+    return os.path.join(rollup_folder, f"{tier}-{period}{readings_file_ext}")
+
+
+def summarize_rollup(rollup):
+    return {
+        "time": asctime(rollup["start"].timetuple()),
+        "ts": int(rollup["start"].timestamp()),
+        "count": rollup["count"],
+        "mean": {
+            field: round(total / rollup["n"][field], 2) if rollup["n"][field] else None
+            for field, total in rollup["sum"].items()
+        },
+        "min": dict(rollup["min"]),
+        "max": dict(rollup["max"]),
+    }
+
+
+def add_to_rollup(tier, entry, reading_time, writer):
+    bucket_start = get_rollup_bucket_start(tier, reading_time)
+    rollup = open_rollups.get(tier)
+
+    if rollup is not None and rollup["start"] != bucket_start:
+        writer.write(
+            get_rollup_file_path(tier, rollup["start"]), summarize_rollup(rollup)
+        )
+        rollup = None
+
+    if rollup is None:
+        rollup = {
+            "start": bucket_start,
+            "count": 0,
+            "sum": {},
+            "n": {},
+            "min": {},
+            "max": {},
+        }
+        open_rollups[tier] = rollup
+
+    rollup["count"] += 1
+    for field, value in entry.items():
+        if field in ("time", "ts"):
+            continue
+        if field not in rollup["sum"]:
+            rollup["sum"][field] = 0
+            rollup["n"][field] = 0
+            rollup["min"][field] = None
+            rollup["max"][field] = None
+        if value is None:
+            continue
+        rollup["sum"][field] += value
+        rollup["n"][field] += 1
+        if rollup["min"][field] is None or value < rollup["min"][field]:
+            rollup["min"][field] = value
+        if rollup["max"][field] is None or value > rollup["max"][field]:
+            rollup["max"][field] = value
+
+
+def update_rollups(entry, writer):
+    try:
+        reading_time = datetime.fromtimestamp(get_readings_timestamp(entry))
+        with rollup_lock:
+            for tier in rollup_tiers:
+                add_to_rollup(tier, entry, reading_time, writer)
+
+    except Exception as e:
+        logging.error(f"Error updating rollups: {e}")
+
+
+def get_last_rollup_start(tier):
+    rollup_files = sorted(glob.glob(os.path.join(rollup_folder, f"{tier}-*")))
+    for file_path in reversed(rollup_files):
+        records = read_readings_file(file_path)
+        if records:
+            return datetime.fromtimestamp(get_readings_timestamp(records[-1]))
+    return None
+
+
+def load_rollups(writer):
+    last_starts = {tier: get_last_rollup_start(tier) for tier in rollup_tiers}
+    known_starts = [start for start in last_starts.values() if start is not None]
+    if len(known_starts) == len(rollup_tiers):
+        resume_date = min(known_starts).strftime("%Y-%m-%d")
+    else:
+        resume_date = ""
+
+    # Replay saved readings not yet part of a closed bucket, this also fills
+    # the rollups from scratch the first time the app runs with them
+    day_files = sorted(
+        glob.glob(os.path.join(app_data_folder, f"*{readings_file_ext}"))
+    )
+    day_files = [f for f in day_files if os.path.basename(f) >= resume_date]
+    logging.debug(f"Replaying {len(day_files)} readings files into rollups")
+
+    with rollup_lock:
+        for file_path in day_files:
+            for entry in read_readings_file(file_path):
+                try:
+                    reading_time = datetime.fromtimestamp(get_readings_timestamp(entry))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                for tier, last_start in last_starts.items():
+                    bucket_start = get_rollup_bucket_start(tier, reading_time)
+                    if last_start is None or bucket_start > last_start:
+                        add_to_rollup(tier, entry, reading_time, writer)
+
+    writer.flush()
+
+
+def get_open_rollup(tier):
+    if app_role == "web":
+        snapshot = read_state_snapshot()
+        return snapshot["rollups"].get(tier) if snapshot is not None else None
+    with rollup_lock:
+        if tier in open_rollups:
+            return summarize_rollup(open_rollups[tier])
+    return None
+
+
+def get_period_files(folder, prefix, first_period, last_period, pending):
+    # Only the files that exist or are waiting in the writer, going through
+    # every period of a wide window would take minutes
+    file_paths = set(glob.glob(os.path.join(folder, f"{prefix}*{readings_file_ext}")))
+    file_paths.update(path for path in pending if os.path.dirname(path) == folder)
+    selected = []
+    for file_path in file_paths:
+        name = os.path.basename(file_path)
+        if not name.startswith(prefix) or not name.endswith(readings_file_ext):
+            continue
+        period = name[len(prefix) : -len(readings_file_ext)]
+        if len(period) == len(first_period) and first_period <= period <= last_period:
+            selected.append(file_path)
+    return sorted(selected)
+
+
+def get_day_files(past_time, end_time, pending):
+    return get_period_files(
+        app_data_folder,
+        "",
+        past_time.strftime("%Y-%m-%d"),
+        end_time.strftime("%Y-%m-%d"),
+        pending,
+    )
+
+
+def load_rollup_readings(tier, past_time, end_time=None, envelope=False):
+    end_time = end_time or datetime.now()
+    pending = get_pending_readings()
+    files_to_check = get_period_files(
+        rollup_folder,
+        f"{tier}-",
+        past_time.strftime(rollup_tiers[tier]),
+        end_time.strftime(rollup_tiers[tier]),
+        pending,
+    )
+
+    # Closed buckets still waiting in the writer aren't in the files yet
+    records = {}
+    for file_path in files_to_check:
+        records.update(load_readings_file(file_path))
+        records.update((record["ts"], record) for record in pending.get(file_path, []))
+
+    record = get_open_rollup(tier)
+    if record is not None:
+        records[record["ts"]] = record
+
+    past_timestamp = get_rollup_bucket_start(tier, past_time).timestamp()
+    end_timestamp = end_time.timestamp()
+    readings = []
+    for timestamp, record in sorted(records.items(), key=lambda item: item[0]):
+        if timestamp < past_timestamp or timestamp > end_timestamp:
+            continue
+        reading = {"time": record["time"], "ts": timestamp, **record["mean"]}
+        if envelope:
+            reading.update({f"{key}Min": value for key, value in record["min"].items()})
+            reading.update({f"{key}Max": value for key, value in record["max"].items()})
+        readings.append(reading)
+    return readings
+
+
+def save_readings_file():
+    try:
+        readings_storage.save(current_readings)
+        logging.debug(f"Readings queued at {datetime.now().strftime('%H:%M')}")
 
     except Exception as e:
         logging.error(f"Error saving readings: {e}")
@@ -407,59 +1577,904 @@ def save_readings_file():
 def create_data_folder():
     if not os.path.isdir(app_data_folder):
         os.makedirs(app_data_folder)
+    if not os.path.isdir(rollup_folder):
+        os.makedirs(rollup_folder)
+
+
+def migrate_readings_files():
+    legacy_files = sorted(glob.glob(os.path.join(app_data_folder, "*.json")))
+    if not legacy_files:
+        return
+
+    logging.debug(
+        f"Migrating {len(legacy_files)} readings files to {readings_file_ext}"
+    )
+    for legacy_path in legacy_files:
+        file_path = os.path.splitext(legacy_path)[0] + readings_file_ext
+
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Error migrating {legacy_path}, skipping: {e}")
+            continue
+
+        if not isinstance(data, list):
+            data = []
+        # Keep any record already appended in the new format for the same day
+        if os.path.exists(file_path):
+            data.extend(read_readings_file(file_path))
+
+        write_readings_file_atomic(file_path, data)
+        os.remove(legacy_path)
+
+
+def load_day_readings(past_time, end_time=None):
+    end_time = end_time or datetime.now()
+    readings = []
+    past_timestamp = past_time.timestamp()
+    end_timestamp = end_time.timestamp()
+    pending_readings = get_pending_readings()
+
+    for file_path in get_day_files(past_time, end_time, pending_readings):
+        entries = load_readings_file(file_path)
+        pending = pending_readings.get(file_path, [])
+        if pending:
+            # Records being written can already be in the file too
+            entries = {**dict(entries), **{entry["ts"]: entry for entry in pending}}
+            entries = entries.items()
+
+        readings.extend(
+            (timestamp, entry)
+            for timestamp, entry in entries
+            if past_timestamp <= timestamp <= end_timestamp
+        )
 
+    readings.sort(key=lambda reading: reading[0])
+    return [entry for _, entry in readings]
 
-def load_downsample_readings(arg):
+
+def get_pending_readings():
+    if app_role == "web":
+        snapshot = read_state_snapshot()
+        return snapshot["pending"] if snapshot is not None else {}
+    return readings_storage.writer.get_pending()
+
+
+def get_pending_records(target):
+    return get_pending_readings().get(target, [])
+
+
+class JsonReadingsStorage:
+    name = "json"
+
+    def __init__(self):
+        self.writer = ReadingsWriter(
+            self.append_records, Config.SAVE_FLUSH_INTERVAL, Config.SAVE_FLUSH_SIZE
+        )
+
+    def append_records(self, file_path, records):
+        return append_readings_records(file_path, records, Config.SAVE_FSYNC)
+
+    def open(self, read_only=False):
+        if read_only:
+            return
+        load_rollups(self.writer)
+        self.writer.thread.start()
+
+    def close(self):
+        self.writer.stop()
+
+    def save(self, entry):
+        reading_time = datetime.fromtimestamp(get_readings_timestamp(entry))
+        self.writer.write(get_readings_file_path(reading_time), entry)
+        update_rollups(entry, self.writer)
+
+    def load_readings(self, past_time, end_time=None):
+        readings = load_day_readings(past_time, end_time)
+        logging.debug(f"Readings cache: {get_readings_cache_stats()}")
+        return readings
+
+    def load_aggregates(self, tier, past_time, end_time=None, envelope=False):
+        readings = load_rollup_readings(tier, past_time, end_time, envelope)
+        logging.debug(f"Readings cache: {get_readings_cache_stats()}")
+        return readings
+
+    def iter_readings(self, past_time, end_time):
+        # Straight from the files, a long export would flush the cache otherwise
+        past_timestamp = past_time.timestamp()
+        end_timestamp = end_time.timestamp()
+        pending_readings = get_pending_readings()
+        for file_path in get_day_files(past_time, end_time, pending_readings):
+            # Records being written can already be in the file too, they're newer
+            # than the rest so they go after it
+            pending = {
+                entry["ts"]: entry for entry in pending_readings.get(file_path, [])
+            }
+            entries = iter_readings_file(file_path) if os.path.exists(file_path) else []
+            for entry in entries:
+                try:
+                    entry["ts"] = get_readings_timestamp(entry)
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if entry["ts"] in pending:
+                    continue
+                if past_timestamp <= entry["ts"] <= end_timestamp:
+                    yield entry
+            for timestamp, entry in sorted(pending.items()):
+                if past_timestamp <= timestamp <= end_timestamp:
+                    yield entry
+
+
+def get_utc_offset(timestamp):
+    local_time = datetime.fromtimestamp(timestamp, timezone.utc).astimezone()
+    return int(local_time.utcoffset().total_seconds())
+
+
+def get_utc_offsets(past_time, end_time):
+    # Check the offset once a day, and every half hour on the days it changes
+    offsets = []
+    start = int(past_time.timestamp()) // 1800 * 1800
+    for timestamp in range(start, int(end_time.timestamp()) + 86400, 86400):
+        offset = get_utc_offset(timestamp)
+        if not offsets:
+            offsets.append((timestamp, offset))
+        elif offsets[-1][1] != offset:
+            changed_at = next(
+                moment
+                for moment in range(timestamp - 86400 + 1800, timestamp + 1, 1800)
+                if get_utc_offset(moment) == offset
+            )
+            offsets.append((changed_at, offset))
+    return offsets
+
+
+def quote_sql_name(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SqliteReadingsStorage:
+    name = "sqlite"
+    bucket_seconds = {"hourly": 3600, "daily": 86400}
+
+    def __init__(self, file_path=readings_database_file):
+        self.file_path = file_path
+        self.fields = ()
+        self.read_only = False
+        self.local = threading.local()
+        self.writer = ReadingsWriter(
+            self.insert_records, Config.SAVE_FLUSH_INTERVAL, Config.SAVE_FLUSH_SIZE
+        )
+
+    def connect(self):
+        # SQLite connections can't be shared between threads, one per thread
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.file_path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                f"PRAGMA synchronous={'FULL' if Config.SAVE_FSYNC else 'NORMAL'}"
+            )
+            self.local.connection = connection
+        return connection
+
+    def open(self, read_only=False):
+        connection = self.connect()
+        self.read_only = read_only
+        if read_only:
+            self.fields = self.get_fields()
+            return
+        with connection:
+            # The timestamp is the primary key, so the table is stored in time order
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS readings (ts INTEGER PRIMARY KEY)"
+            )
+        self.fields = self.get_fields()
+        self.import_json_readings()
+        self.writer.thread.start()
+
+    def get_fields(self):
+        return tuple(
+            row[1]
+            for row in self.connect().execute("PRAGMA table_info(readings)")
+            if row[1] != "ts"
+        )
+
+    def get_query_fields(self):
+        # Another process writes the readings and may add columns at any time
+        if self.read_only:
+            self.fields = self.get_fields()
+        return self.fields
+
+    def has_readings_table(self):
+        return bool(self.fields) or bool(
+            self.connect()
+            .execute("SELECT 1 FROM sqlite_master WHERE name = 'readings'")
+            .fetchone()
+        )
+
+    def close(self):
+        self.writer.stop()
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def save(self, entry):
+        self.writer.write("readings", entry)
+
+    def add_fields(self, connection, fields):
+        for field in fields:
+            if field not in self.fields:
+                with connection:
+                    connection.execute(
+                        f"ALTER TABLE readings ADD COLUMN {quote_sql_name(field)} REAL"
+                    )
+                self.fields = (*self.fields, field)
+
+    def insert_records(self, table, records):
+        fields = list(
+            dict.fromkeys(
+                key for record in records for key in record if key not in ("time", "ts")
+            )
+        )
+        connection = self.connect()
+        self.add_fields(connection, fields)
+
+        columns = ", ".join(quote_sql_name(name) for name in ["ts", *fields])
+        placeholders = ", ".join("?" * (len(fields) + 1))
+        with connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO {table} ({columns}) VALUES ({placeholders})",
+                (
+                    (get_readings_timestamp(record), *map(record.get, fields))
+                    for record in records
+                ),
+            )
+
+    def import_json_readings(self):
+        connection = self.connect()
+        (last_timestamp,) = connection.execute(
+            "SELECT max(ts) FROM readings"
+        ).fetchone()
+        if last_timestamp is None:
+            last_timestamp = 0
+            resume_date = ""
+        else:
+            resume_date = datetime.fromtimestamp(last_timestamp).strftime("%Y-%m-%d")
+
+        day_files = sorted(
+            glob.glob(os.path.join(app_data_folder, f"*{readings_file_ext}"))
+        )
+        day_files = [f for f in day_files if os.path.basename(f) >= resume_date]
+        logging.debug(
+            f"Importing {len(day_files)} readings files into {self.file_path}"
+        )
+
+        for file_path in day_files:
+            records = []
+            for entry in read_readings_file(file_path):
+                try:
+                    entry["ts"] = get_readings_timestamp(entry)
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if entry["ts"] > last_timestamp:
+                    records.append(entry)
+            if records:
+                self.insert_records("readings", records)
+
+    def load_readings(self, past_time, end_time=None):
+        return list(self.iter_readings(past_time, end_time or datetime.now()))
+
+    def get_source(self, fields, past_timestamp, end_timestamp):
+        # Rows still waiting in the writer are added to the ones in the table,
+        # UNION drops those that are already in both
+        columns = "".join(f", {quote_sql_name(field)}" for field in fields)
+        query = f"SELECT ts{columns} FROM readings WHERE ts BETWEEN ? AND ?"
+        parameters = [past_timestamp, end_timestamp]
+        pending = [
+            record
+            for record in get_pending_records("readings")
+            if past_timestamp <= get_readings_timestamp(record) <= end_timestamp
+        ]
+        if pending:
+            row = f"({', '.join('?' * (len(fields) + 1))})"
+            query += f" UNION VALUES {', '.join([row] * len(pending))}"
+            for record in pending:
+                parameters.append(get_readings_timestamp(record))
+                parameters.extend(map(record.get, fields))
+        return f"({query})", parameters
+
+    def get_stored_range(self, past_time, end_time):
+        # The UTC offsets are checked day by day, only over the stored readings
+        timestamps = [
+            get_readings_timestamp(record) for record in get_pending_records("readings")
+        ]
+        timestamps.extend(
+            timestamp
+            for timestamp in self.connect()
+            .execute("SELECT min(ts), max(ts) FROM readings")
+            .fetchone()
+            if timestamp is not None
+        )
+        if not timestamps:
+            return None
+        past_time = max(past_time, datetime.fromtimestamp(min(timestamps)))
+        end_time = min(end_time, datetime.fromtimestamp(max(timestamps)))
+        if past_time > end_time:
+            return None
+        return past_time, end_time
+
+    def iter_readings(self, past_time, end_time):
+        fields = self.get_query_fields()
+        if not self.has_readings_table():
+            return
+        columns = "".join(f", {quote_sql_name(field)}" for field in fields)
+        source, parameters = self.get_source(
+            fields, past_time.timestamp(), end_time.timestamp()
+        )
+        rows = self.connect().execute(
+            f"SELECT ts{columns} FROM {source} ORDER BY ts", parameters
+        )
+        for row in rows:
+            yield {
+                "time": asctime(localtime(row[0])),
+                "ts": row[0],
+                **dict(zip(fields, row[1:])),
+            }
+
+    def load_aggregates(self, tier, past_time, end_time=None, envelope=False):
+        fields = self.get_query_fields()
+        if not self.has_readings_table():
+            return []
+        aggregates = ["avg", "min", "max"] if envelope else ["avg"]
+        columns = "".join(
+            f", {function}({quote_sql_name(field)})"
+            for field in fields
+            for function in aggregates
+        )
+        end_time = end_time or datetime.now()
+        stored_range = self.get_stored_range(past_time, end_time)
+        if stored_range is None:
+            return []
+        past_time, end_time = stored_range
+
+        # Buckets follow local time, shifting each timestamp by its UTC offset is
+        # much cheaper than SQLite's localtime conversion
+        offsets = get_utc_offsets(past_time, end_time)
+        local_ts = f"ts + {offsets[-1][1]}"
+        if len(offsets) > 1:
+            changes = "".join(
+                f"WHEN ts < {start} THEN {offset} "
+                for (start, _), (_, offset) in zip(offsets[1:], offsets)
+            )
+            local_ts = f"ts + CASE {changes}ELSE {offsets[-1][1]} END"
+        size = self.bucket_seconds[tier]
+        source, parameters = self.get_source(
+            fields,
+            get_rollup_bucket_start(tier, past_time).timestamp(),
+            end_time.timestamp(),
+        )
+        rows = self.connect().execute(
+            f"SELECT ({local_ts}) / {size} AS bucket{columns} FROM {source} "
+            "GROUP BY bucket ORDER BY bucket",
+            parameters,
+        )
+
+        readings = []
+        for row in rows:
+            bucket_start = datetime.fromtimestamp(row[0] * size, timezone.utc)
+            timestamp = int(bucket_start.replace(tzinfo=None).timestamp())
+            reading = {"time": asctime(localtime(timestamp)), "ts": timestamp}
+            values = iter(row[1:])
+            for field in fields:
+                mean = next(values)
+                reading[field] = None if mean is None else round(mean, 2)
+                if envelope:
+                    reading[f"{field}Min"] = next(values)
+                    reading[f"{field}Max"] = next(values)
+            readings.append(reading)
+        return readings
+
+
+storage_backends = {
+    "json": JsonReadingsStorage,
+    "sqlite": SqliteReadingsStorage,
+}
+if Config.STORAGE_BACKEND not in storage_backends:
+    logging.error(
+        f"Unknown storage backend {Config.STORAGE_BACKEND}, using json instead"
+    )
+readings_storage = storage_backends.get(Config.STORAGE_BACKEND, JsonReadingsStorage)()
+
+
+def select_lttb_points(timestamps, values, starts, bucket_ts, means):
+    # Largest-Triangle-Three-Buckets, computed for every field at once
+    ends = np.append(starts[1:], len(timestamps))
+    selected = np.empty((len(starts), values.shape[1]), dtype=np.int64)
+    selected[0] = starts[0]
+    selected[-1] = len(timestamps) - 1
+    columns = np.arange(values.shape[1])
+
+    for i in range(1, len(starts) - 1):
+        ta = timestamps[selected[i - 1]]
+        va = values[selected[i - 1], columns]
+        tb = timestamps[starts[i] : ends[i], None]
+        vb = values[starts[i] : ends[i]]
+        area = np.abs(
+            (ta - bucket_ts[i + 1]) * (vb - va) - (ta - tb) * (means[i + 1] - va)
+        )
+        selected[i] = starts[i] + np.where(np.isnan(area), -1, area).argmax(axis=0)
+
+    return selected
+
+
+def get_bucket_starts(timestamps, points, bucket_seconds=None):
+    # Split the time range into equal buckets, readings are already sorted by time
+    if bucket_seconds is not None:
+        # Aligned to the clock, so the newest buckets can be asked for again alone
+        buckets = (timestamps // bucket_seconds).astype(np.int64)
+    else:
+        span = max(timestamps[-1] - timestamps[0], 1)
+        buckets = ((timestamps - timestamps[0]) * points // span).astype(np.int64)
+        buckets = np.minimum(buckets, points - 1)
+    return np.flatnonzero(np.diff(buckets, prepend=-1))
+
+
+def downsample_readings(readings, points, aggregate="mean", bucket_seconds=None):
+    if not readings or (points is None and bucket_seconds is None):
+        return readings
+    if bucket_seconds is None and len(readings) <= points and aggregate != "minmax":
+        return readings
+
+    keys = dict.fromkeys(key for reading in readings for key in reading)
+    fields = [
+        key
+        for key in keys
+        if key not in ("time", "ts") and not key.endswith(("Min", "Max"))
+    ]
+    timestamps = np.fromiter(
+        (reading["ts"] for reading in readings), dtype=np.float64, count=len(readings)
+    )
+    values = np.array(
+        [[reading.get(field) for field in fields] for reading in readings],
+        dtype=np.float64,
+    )
+    lows = highs = None
+    # Rollup records bring the min/max of each bucket they summarize
+    if aggregate == "minmax" and any(key.endswith("Min") for key in keys):
+        lows, highs = (
+            np.array(
+                [
+                    [reading.get(field + suffix) for field in fields]
+                    for reading in readings
+                ],
+                dtype=np.float64,
+            )
+            for suffix in ("Min", "Max")
+        )
+    return downsample_columns(
+        timestamps, fields, values, points, aggregate, bucket_seconds, lows, highs
+    )
+
+
+def downsample_columns(
+    timestamps,
+    fields,
+    values,
+    points,
+    aggregate="mean",
+    bucket_seconds=None,
+    lows=None,
+    highs=None,
+):
+    if aggregate == "lttb" and len(timestamps) > 2:
+        # LTTB keeps the first and last readings in buckets of their own and
+        # splits the others between the remaining buckets
+        inner_starts = get_bucket_starts(
+            timestamps[1:-1], max(points - 2, 1), bucket_seconds
+        )
+        starts = np.concatenate(([0], inner_starts + 1, [len(timestamps) - 1]))
+    else:
+        starts = get_bucket_starts(timestamps, points, bucket_seconds)
+    sizes = np.diff(np.append(starts, len(timestamps)))
+
+    bucket_ts = np.add.reduceat(timestamps, starts) / sizes
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts
+
+    point_timestamps = {}
+    if aggregate == "lttb" and len(starts) > 2:
+        selected = select_lttb_points(timestamps, values, starts, bucket_ts, means)
+        columns = dict(zip(fields, values[selected, np.arange(len(fields))].T))
+        # Each field keeps its own points, `<field>Ts` is when they were read
+        point_timestamps = dict(zip(fields, timestamps[selected].T))
+    else:
+        columns = dict(zip(fields, means.T))
+
+    if aggregate == "minmax":
+        if lows is None:
+            lows = highs = values
+        for field, low, high in zip(
+            fields,
+            np.fmin.reduceat(lows, starts, axis=0).T,
+            np.fmax.reduceat(highs, starts, axis=0).T,
+        ):
+            columns[f"{field}Min"] = low
+            columns[f"{field}Max"] = high
+
+    rows = [
+        {"time": asctime(localtime(timestamp)), "ts": int(timestamp)}
+        for timestamp in bucket_ts.tolist()
+    ]
+    for field, column in columns.items():
+        for row, value in zip(rows, np.round(column, 2).tolist()):
+            row[field] = value if value == value else None
+    for field, column in point_timestamps.items():
+        for row, timestamp in zip(rows, column.astype(np.int64).tolist()):
+            row[f"{field}Ts"] = timestamp
+    return rows
+
+
+def get_range_source(past_time, end_time):
+    oldest_timestamp = recent_readings.get_oldest_timestamp()
+    if oldest_timestamp is not None and oldest_timestamp <= past_time.timestamp():
+        return "recent"
+    if end_time - past_time <= timedelta(days=2):
+        return "readings"
+    if end_time - past_time <= timedelta(days=62):
+        return "hourly"
+    return "daily"
+
+
+def load_downsample_readings(
+    arg, points=None, aggregate="mean", since=None, start=None, end=None
+):
     now = datetime.now()
-    if arg == "day" or arg == "":
+    end_time = now
+    if start is not None or end is not None:
+        end_time = datetime.fromtimestamp(end) if end is not None else now
+        if start is not None:
+            past_time = datetime.fromtimestamp(start)
+        else:
+            past_time = end_time - timedelta(hours=24)
+        if past_time >= end_time:
+            return [{}]
+        source = get_range_source(past_time, end_time)
+        max_readings = 360 if source == "recent" else 192
+    elif arg == "hour":
+        past_time = now - timedelta(hours=1)
+        source = "recent"
+        max_readings = 360
+    elif arg == "day" or arg == "":
         past_time = now - timedelta(hours=24)
+        source = "readings"
         max_readings = None
     elif arg == "week":
         past_time = now - timedelta(days=7)
+        source = rollup_views[arg]
         max_readings = 192
     elif arg == "month":
         past_time = now - timedelta(days=30)
+        source = rollup_views[arg]
         max_readings = 192
     elif arg == "year":
         past_time = now - timedelta(days=365)
+        source = rollup_views[arg]
         max_readings = 192
     else:
-        return "[{}]"
-
-    readings = []
-    past_timestamp = past_time.timestamp()
-    days_to_check = (now - past_time).days + 1  # +1 to include today
-    files_to_check = [now - timedelta(days=i) for i in range(days_to_check)]
-
-    for file_date in files_to_check:
-        file_path = os.path.join(app_data_folder, file_date.strftime("%Y-%m-%d.json"))
-
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                try:
-                    data = json.load(f)
-                    day_readings = [
-                        entry
-                        for entry in data
-                        if datetime.strptime(
-                            entry["time"], "%a %b %d %H:%M:%S %Y"
-                        ).timestamp()
-                        >= past_timestamp
-                    ]
-
-                    readings.extend(day_readings)
+        return [{}]
+
+    bucket_seconds = None
+    if start is None and end is None and (points or max_readings):
+        bucket_seconds = (now - past_time).total_seconds() / (points or max_readings)
+
+    if since is not None:
+        # Only the readings the client doesn't have yet, from the start of the
+        # bucket of its latest one because that bucket keeps changing until it's
+        # closed. The client replaces its points from `since` with these.
+        if bucket_seconds is not None:
+            since = floor(since / bucket_seconds) * bucket_seconds
+        past_time = max(past_time, datetime.fromtimestamp(since))
+
+    if source == "recent":
+        timestamps, columns = recent_readings.get_columns()
+        recent = (timestamps >= past_time.timestamp()) & (
+            timestamps <= end_time.timestamp()
+        )
+        points = points or max_readings
+        if not recent.any():
+            return []
+        if bucket_seconds is not None or recent.sum() > points or aggregate == "minmax":
+            # Straight from the buffer's columns, without a dict for each reading
+            values = np.column_stack([column[recent] for column in columns.values()])
+            return downsample_columns(
+                timestamps[recent],
+                list(columns),
+                values,
+                points,
+                aggregate,
+                bucket_seconds,
+            )
+        readings = recent_readings.get_rows(past_time.timestamp(), end_time.timestamp())
+    elif not storage_ready.is_set():
+        return abort(503)
+    elif source in rollup_tiers:
+        envelope = aggregate == "minmax"
+        readings = readings_storage.load_aggregates(
+            source, past_time, end_time, envelope
+        )
+    else:
+        readings = readings_storage.load_readings(past_time, end_time)
 
-                except json.JSONDecodeError:
-                    logging.error(f"Error reading {file_path}, skipping")
+    if since is not None:
+        readings = [reading for reading in readings if reading["ts"] >= since]
 
-    readings.sort(key=lambda x: datetime.strptime(x["time"], "%a %b %d %H:%M:%S %Y"))
+    return downsample_readings(
+        readings, points or max_readings, aggregate, bucket_seconds
+    )
 
-    # Downsample if max_readings is set
-    if max_readings and len(readings) > max_readings:
-        step = len(readings) // max_readings
-        readings = readings[::step]  # Take evenly spaced readings
 
-    return json.dumps(readings, indent=4)
+def iter_json_array(rows, batch_size=64):
+    yield "["
+    separator = ""
+    batch = []
+    for row in rows:
+        batch.append(json.dumps(row, separators=(",", ":")))
+        if len(batch) == batch_size:
+            yield separator + ",".join(batch)
+            separator = ","
+            batch = []
+    if batch:
+        yield separator + ",".join(batch)
+    yield "]"
+
+
+def iter_json_columns(rows, fields, batch_size=256):
+    yield "{"
+    for index, key in enumerate(["ts", *fields]):
+        yield f"{',' if index else ''}{json.dumps(key)}:["
+        for start in range(0, len(rows), batch_size):
+            batch = [row.get(key) for row in rows[start : start + batch_size]]
+            values = json.dumps(batch, separators=(",", ":"))[1:-1]
+            yield f",{values}" if start else values
+        yield "]"
+    yield "}"
+
+
+def select_graph_fields(rows, fields=None):
+    keys = dict.fromkeys(
+        key for row in rows for key in row if key not in ("time", "ts")
+    )
+    if fields:
+        keys = [
+            key
+            for key in keys
+            if key in fields
+            or (key.endswith(("Min", "Max")) and key[:-3] in fields)
+            or (key.endswith("Ts") and key[:-2] in fields)
+        ]
+    return list(keys)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export_csv(readings, fields, batch_size=256):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["time", "ts", *fields])
+    for index, reading in enumerate(readings, start=1):
+        writer.writerow(
+            [reading.get("time"), reading.get("ts"), *map(reading.get, fields)]
+        )
+        if index % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_export_ndjson(readings, fields, batch_size=256):
+    batch = []
+    for reading in readings:
+        row = {"time": reading.get("time"), "ts": reading.get("ts")}
+        row.update((field, reading.get(field)) for field in fields)
+        batch.append(json.dumps(row, separators=(",", ":")) + "\n")
+        if len(batch) == batch_size:
+            yield "".join(batch)
+            batch = []
+    yield "".join(batch)
+
+
+def stream_response(chunks, mimetype="application/json"):
+    headers = {"Vary": "Accept-Encoding"}
+    if request.accept_encodings["gzip"]:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+
+def get_summary_samples(summary, labels=None):
+    return [("_count", labels, summary.count), ("_sum", labels, summary.total)]
+
+
+def get_sensor_metrics():
+    writer = readings_storage.writer
+    metrics = [
+        (
+            "enviroplusweb_reading",
+            "gauge",
+            "Latest value of each reading",
+            [
+                ("", {"field": field}, value)
+                for field, value in current_readings.items()
+                if field not in ("time", "ts")
+            ],
+        ),
+        (
+            "enviroplusweb_sensor_read_seconds",
+            "summary",
+            "Time spent reading each sensor",
+            [
+                sample
+                for task in sensor_tasks
+                for sample in get_summary_samples(task.read_time, {"sensor": task.name})
+            ],
+        ),
+        (
+            "enviroplusweb_sensor_failures_total",
+            "counter",
+            "Failed sensor reads, for the particles sensor each one is a retry",
+            [("", {"sensor": task.name}, task.failures) for task in sensor_tasks],
+        ),
+        (
+            "enviroplusweb_sensor_overruns_total",
+            "counter",
+            "Sensor reads slower than their deadline",
+            [("", {"sensor": task.name}, task.overruns) for task in sensor_tasks],
+        ),
+        (
+            "enviroplusweb_sensor_age_seconds",
+            "gauge",
+            "Time since the last good read of each sensor",
+            [("", {"sensor": task.name}, task.get_age()) for task in sensor_tasks],
+        ),
+        (
+            "enviroplusweb_startup_seconds",
+            "gauge",
+            "Time spent in each startup phase",
+            [
+                ("", {"phase": phase}, seconds)
+                for phase, seconds in list(startup_times.items())
+            ],
+        ),
+        (
+            "enviroplusweb_loop_period_seconds",
+            "summary",
+            "Time between two iterations of the background loop",
+            get_summary_samples(loop_period),
+        ),
+        (
+            "enviroplusweb_loop_jitter_seconds",
+            "summary",
+            "Delay of each background loop iteration after its scheduled tick",
+            get_summary_samples(loop_jitter),
+        ),
+        (
+            "enviroplusweb_lcd_draw_seconds",
+            "summary",
+            "Time spent drawing the readings on the LCD screen",
+            get_summary_samples(lcd_draw_time),
+        ),
+        (
+            "enviroplusweb_save_seconds",
+            "summary",
+            "Time spent writing each batch of saved readings",
+            get_summary_samples(writer.write_time),
+        ),
+        (
+            "enviroplusweb_saved_records_total",
+            "counter",
+            "Readings and rollup records written to storage",
+            [("", None, writer.records_written)],
+        ),
+        (
+            "enviroplusweb_saved_bytes_total",
+            "counter",
+            "Bytes appended to the readings files",
+            [("", None, writer.bytes_written)],
+        ),
+        (
+            "enviroplusweb_save_errors_total",
+            "counter",
+            "Batches of readings that couldn't be saved",
+            [("", None, writer.errors)],
+        ),
+    ]
+    if Config.OPENWEATHER_ENABLED:
+        metrics.append(
+            (
+                "enviroplusweb_weather_failures_total",
+                "counter",
+                "Failed requests to the weather API",
+                [("", None, weather_refresher.failures_total)],
+            )
+        )
+    return metrics
+
+
+def get_server_metrics():
+    cache_stats = get_readings_cache_stats()
+    # Each scrape reaches one of the web workers, the pid keeps their counters
+    # apart instead of looking like resets
+    labels = {"pid": os.getpid()} if app_role == "web" else {}
+    return [
+        (
+            "enviroplusweb_graph_seconds",
+            "summary",
+            "Time spent loading and downsampling the readings of a graph",
+            [
+                sample
+                for view, summary in graph_times.items()
+                for sample in get_summary_samples(summary, {"range": view, **labels})
+            ],
+        ),
+        (
+            "enviroplusweb_readings_cache_hits_total",
+            "counter",
+            "Readings files served from memory",
+            [("", labels, cache_stats["hits"])],
+        ),
+        (
+            "enviroplusweb_readings_cache_misses_total",
+            "counter",
+            "Readings files parsed from disk",
+            [("", labels, cache_stats["misses"])],
+        ),
+        (
+            "enviroplusweb_live_clients",
+            "gauge",
+            "Browsers connected to the live readings stream",
+            [("", labels, len(readings_subscribers))],
+        ),
+    ]
+
+
+def get_metrics_text():
+    if app_role == "web":
+        # Web workers add their own metrics to the ones published by the sampler
+        snapshot = read_state_snapshot()
+        sensor_text = snapshot["metrics"] if snapshot is not None else ""
+        return sensor_text + format_metrics(get_server_metrics())
+    return format_metrics(get_sensor_metrics() + get_server_metrics())
+
+
+def format_metrics(metrics):
+    lines = []
+    for name, kind, description, samples in metrics:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            if value is None or isinstance(value, str):
+                continue
+            if labels:
+                label_text = ",".join(
+                    f'{key}="{label}"' for key, label in labels.items()
+                )
+                lines.append(f"{name}{suffix}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{name}{suffix} {value}")
+    return "\n".join(lines) + "\n"
 
 
 def set_next_save_readings():
@@ -473,51 +2488,270 @@ def set_next_save_readings():
 
 def check_next_save_readings():
     global next_save_time
-    if datetime.now() >= next_save_time:
+    # A reading taken before every sensor answered would be saved mostly empty
+    if datetime.now() >= next_save_time and not is_warming_up():
         save_readings_file()
         next_save_time += timedelta(minutes=save_readings_interval)
 
 
+def get_device_names():
+    device_names = ["bme280", "ltr559", "noise"]
+    if Config.GAS_SENSOR:
+        device_names.append("gas")
+    if Config.PARTICULATE_SENSOR:
+        device_names.append("pms5003")
+    return device_names
+
+
+def setup_device(name, setup, *args):
+    try:
+        run_startup_phase(f"device_{name}", setup, *args)
+    except Exception as e:
+        logging.error(f"Error setting up '{name}': {type(e).__name__} - {e}")
+
+
+def setup_devices():
+    setups = {name: (hardware.get_device, name) for name in get_device_names()}
+    setups["microphone"] = (noise_analyzer.start,)
+    if Config.FAN_GPIO_ENABLED:
+        setups["fan"] = (setup_fan,)
+    if Config.LCD_SCREEN_ENABLED:
+        setups["lcd"] = (setup_lcd,)
+    if Config.TEMP_CPU_COMPENSATION:
+        setups["cpu_temperature"] = (setup_cpu_temperature,)
+
+    # Each device waits on its own bus, opening them together takes as long as
+    # the slowest one instead of the sum of all of them
+    with ThreadPoolExecutor(len(setups), thread_name_prefix="setup") as executor:
+        for name, setup in setups.items():
+            executor.submit(setup_device, name, *setup)
+
+
+def log_startup_times():
+    phases = ", ".join(
+        f"{phase} {seconds}s" for phase, seconds in startup_times.items()
+    )
+    logging.debug(f"Startup times: {phases}")
+
+
 def background():
     logging.debug("Initializing background tasks")
+    run_startup_phase("devices", setup_devices)
     set_next_save_readings()
-    sleep(idle_time)
-    while run_flag:
+    for task in sensor_tasks:
+        task.thread.start()
+    if Config.OPENWEATHER_ENABLED:
+        weather_refresher.thread.start()
+
+    next_tick = monotonic() + idle_time
+    last_started_at = None
+    while not stop_event.wait(max(next_tick - monotonic(), 0)):
+        started_at = monotonic()
+        loop_jitter.observe(started_at - next_tick)
+        if last_started_at is not None:
+            loop_period.observe(started_at - last_started_at)
+        last_started_at = started_at
         update_readings()
-        check_next_save_readings()
-        sleep(idle_time)
+        if "first_readings" not in startup_times and not is_warming_up():
+            startup_times["first_readings"] = round(started_at - startup_started_at, 3)
+            log_startup_times()
+        # Readings wait in memory until the storage is open
+        if storage_ready.is_set():
+            check_next_save_readings()
+        next_tick = get_next_tick(next_tick, idle_time)
+
+
+def open_storage():
+    run_startup_phase("migration", migrate_readings_files)
+    run_startup_phase("storage", readings_storage.open)
+    storage_ready.set()
 
 
 background_thread = threading.Thread(target=background)
+storage_thread = threading.Thread(target=open_storage)
+shared_state_thread = threading.Thread(target=watch_shared_state, daemon=True)
+
+
+def run_sampler():
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    init_app()
+    logging.debug(f"Publishing readings to {shared_state_file}")
+    try:
+        while not stop_event.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        kill_app()
+
+
+def load_language(lang):
+    lang_code = os.path.splitext(os.path.basename(lang))[0]
+
+    with open(lang, "r", encoding="utf8") as file:
+        languages[lang_code] = json.loads(file.read())
 
 
 def load_languages():
     logging.debug(f"Loading {len(language_list)} dictionaries")
     for lang in language_list:
-        lang_code = os.path.splitext(os.path.basename(lang))[0]
+        load_language(lang)
+
+
+def fingerprint_css_urls(filename, data):
+    folder = posixpath.dirname(filename)
+
+    def add_hash(match):
+        url = match.group(1)
+        if url.startswith(("data:", "/")) or "://" in url:
+            return match.group(0)
+        asset = get_static_asset(posixpath.normpath(posixpath.join(folder, url)))
+        if asset is None:
+            return match.group(0)
+        return f'url("{url}?v={asset["hash"]}")'
+
+    return static_css_url.sub(add_hash, data.decode("utf-8")).encode("utf-8")
+
+
+def get_static_asset(filename):
+    path = safe_join(static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with static_assets_lock:
+        asset = static_assets.get(filename)
+    if asset is not None and asset["version"] == version:
+        return asset
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if filename.endswith(".css"):
+        # Fonts and images loaded by the stylesheet are fingerprinted too
+        data = fingerprint_css_urls(filename, data)
+    asset = {
+        "version": version,
+        "data": data,
+        "hash": hashlib.sha1(data).hexdigest()[:12],
+        "mimetype": mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        "variants": {},
+    }
+    with static_assets_lock:
+        static_assets[filename] = asset
+    return asset
 
-        with open(lang, "r", encoding="utf8") as file:
-            languages[lang_code] = json.loads(file.read())
+
+def get_static_variant(asset, encoding):
+    # Each asset is only compressed once, with the best level as it's kept
+    variant = asset["variants"].get(encoding)
+    if variant is None:
+        if encoding == "br":
+            variant = brotli.compress(asset["data"])
+        else:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+            variant = compressor.compress(asset["data"]) + compressor.flush()
+        asset["variants"][encoding] = variant
+    return variant
+
+
+def get_static_encoding(filename):
+    if not filename.endswith(static_compressible):
+        return None
+    if brotli is not None and request.accept_encodings["br"]:
+        return "br"
+    if request.accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def get_dashboard_page(language):
+    # The page only changes with the templates, its dictionary or the config
+    language_file = os.path.join("i18n", f"{language}.json")
+    sources = glob.glob(os.path.join(app.root_path, app.template_folder, "*.html"))
+    sources += [language_file, os.path.join(app.root_path, "config.py")]
+    # Asset URLs in the page carry the hash of each file
+    sources += glob.glob(os.path.join(static_folder, "**", "*.*"), recursive=True)
+    version = tuple(os.stat(source).st_mtime for source in sources)
+    key = (language, request.script_root)
+    with dashboard_pages_lock:
+        page = dashboard_pages.get(key)
+    if page is not None and page["version"] == version:
+        return page
+
+    logging.debug("Rendering main page")
+    load_language(language_file)
+    html = render_template(
+        "index.html",
+        **languages[language],
+        gas_sensor=Config.GAS_SENSOR,
+        particulate_sensor=Config.PARTICULATE_SENSOR,
+        fan_gpio=Config.FAN_GPIO_ENABLED,
+        system_units=Config.SYSTEM_UNITS,
+        browser_updates=Config.BROWSER_UPDATES_WHILE_ACTIVE,
+        openweather=Config.OPENWEATHER_ENABLED,
+        reboot_button=Config.REBOOT_BUTTON_ENABLED,  # This controls reboot button visibility
+        shutdown_button=Config.SHUTDOWN_BUTTON_ENABLED,  # This controls button visibility
+    ).encode("utf-8")
+    page = {
+        "version": version,
+        "html": html,
+        "etag": hashlib.sha1(html).hexdigest(),
+        "last_modified": datetime.fromtimestamp(max(version), timezone.utc),
+    }
+    with dashboard_pages_lock:
+        dashboard_pages[key] = page
+    return page
 
 
 def init_app():
-    create_data_folder()
-    load_languages()
+    run_startup_phase("data_folder", create_data_folder)
+    if app_role == "web":
+        # Web workers only read what the sampler writes
+        run_startup_phase("storage", readings_storage.open, True)
+        storage_ready.set()
+        run_startup_phase("languages", load_languages)
+        if not open_shared_state():
+            logging.error("The sampler isn't running, waiting for its readings")
+        shared_state_thread.start()
+        startup_times["ready"] = round(monotonic() - startup_started_at, 3)
+        log_startup_times()
+        return
+
+    if shared_state is not None:
+        run_startup_phase("shared_state", open_shared_state)
+    # Devices are set up and the storage is opened in the background, the
+    # dashboard shows placeholders until the first readings come in
     background_thread.start()
     logging.debug(
         f"Background thread started with a loop interval of {idle_time} seconds"
     )
+    storage_thread.start()
+    run_startup_phase("languages", load_languages)
+    startup_times["ready"] = round(monotonic() - startup_started_at, 3)
 
 
 def kill_app():
     global run_flag
     run_flag = False
-    if Config.FAN_GPIO_ENABLED:
-        GPIO.cleanup()
-    if Config.LCD_SCREEN_ENABLED:
+    stop_event.set()
+    if app_role == "web":
+        shared_state_thread.join()
+        readings_storage.close()
+        return
+
+    hardware.cleanup()
+    if Config.LCD_SCREEN_ENABLED and disp is not None:
         disp.set_backlight(0)
+    noise_analyzer.stop()
     logging.debug("Waiting for background tasks to quit...")
     background_thread.join()
+    for task in sensor_tasks:
+        if task.thread.is_alive():
+            task.thread.join(task.timeout)
+    logging.debug("Writing pending readings to disk...")
+    if storage_thread.is_alive():
+        storage_thread.join()
+    readings_storage.close()
 
 
 @app.route("/")
@@ -538,33 +2772,200 @@ def main_page(language):
         )
         return redirect(f"{app_main_url}/{Config.LANGUAGE_DEFAULT}")
 
-    logging.debug("Rendering main page")
-    return render_template(
-        "index.html",
-        **languages[language],
-        gas_sensor=Config.GAS_SENSOR,
-        particulate_sensor=Config.PARTICULATE_SENSOR,
-        fan_gpio=Config.FAN_GPIO_ENABLED,
-        system_units=Config.SYSTEM_UNITS,
-        browser_updates=Config.BROWSER_UPDATES_WHILE_ACTIVE,
-        openweather=Config.OPENWEATHER_ENABLED,
-        reboot_button=Config.REBOOT_BUTTON_ENABLED,  # This controls reboot button visibility
-        shutdown_button=Config.SHUTDOWN_BUTTON_ENABLED,  # This controls button visibility
-    )
+    page = get_dashboard_page(language)
+    response = Response(page["html"], mimetype="text/html")
+    # Browsers check the page on every load and get a 304 while it's unchanged
+    response.set_etag(page["etag"])
+    response.last_modified = page["last_modified"]
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route("/static/<path:filename>", endpoint="static")
+def static_file(filename):
+    asset = get_static_asset(filename)
+    if asset is None:
+        return abort(404)
+
+    data = asset["data"]
+    encoding = get_static_encoding(filename)
+    if encoding is not None:
+        data = get_static_variant(asset, encoding)
+    response = Response(data, mimetype=asset["mimetype"])
+    if filename.endswith(static_compressible):
+        response.vary.add("Accept-Encoding")
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+        response.set_etag(f"{asset['hash']}-{encoding}")
+    else:
+        response.set_etag(asset["hash"])
+
+    if request.args.get("v") == asset["hash"]:
+        # The URL changes with the file, so browsers never need to check it again
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.url_defaults
+def add_static_hash(endpoint, values):
+    if endpoint == "static" and "v" not in values:
+        asset = get_static_asset(values.get("filename", ""))
+        if asset is not None:
+            values["v"] = asset["hash"]
 
 
 @app.route("/readings", strict_slashes=False)
 def readings():
     if Config.FAN_GPIO_ENABLED:
         arg = request.args.get("fan", "")
-        pwm.ChangeDutyCycle(int(arg))
-    return current_readings
+        if app_role == "web":
+            shared_state.request_fan_speed(int(arg))
+        else:
+            hardware.set_fan_speed(int(arg))
+    return get_live_readings()
+
+
+@app.route("/readings/stream", strict_slashes=False)
+def readings_stream():
+    subscriber = queue.Queue(maxsize=1)
+    # Each stream holds a worker thread while connected, keep some for the rest
+    if app_role == "web":
+        max_clients = Config.LIVE_UPDATES_MAX_CLIENTS_PER_WORKER
+    else:
+        max_clients = Config.LIVE_UPDATES_MAX_CLIENTS
+    with readings_subscribers_lock:
+        if len(readings_subscribers) >= max_clients:
+            logging.debug("Live readings clients limit reached, refusing stream")
+            return abort(503)
+        readings_subscribers.append(subscriber)
+
+    def stream():
+        try:
+            yield f"retry: {idle_time * 1000}\n" + format_readings_event(
+                get_live_readings()
+            )
+            while run_flag:
+                try:
+                    yield subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            with readings_subscribers_lock:
+                readings_subscribers.remove(subscriber)
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/readings/noise", strict_slashes=False)
+def readings_noise():
+    return get_noise_stats()
+
+
+@app.route("/readings/stats", strict_slashes=False)
+def readings_stats_summary():
+    return get_readings_stats()
+
+
+def get_time_range_args():
+    # Timestamps datetime can't represent would fail with a 500 further on
+    since, start, end = (
+        request.args.get(name, type=float) for name in ("since", "from", "to")
+    )
+    for value in (since, start, end):
+        if value is not None and not 0 <= value <= max_timestamp:
+            abort(400)
+    if start is not None and end is not None and start >= end:
+        abort(400)
+    return since, start, end
 
 
 @app.route("/graph", strict_slashes=False)
 def graph():
     arg = request.args.get("time", "")
-    return load_downsample_readings(arg)
+    points = request.args.get("points", type=int)
+    if points is not None:
+        points = min(max(points, 1), max_graph_points)
+    aggregate = request.args.get("agg", "mean")
+    if aggregate not in downsample_aggregates:
+        aggregate = "mean"
+    since, start, end = get_time_range_args()
+    fields = [field for field in request.args.get("fields", "").split(",") if field]
+    started_at = monotonic()
+    readings = load_downsample_readings(arg, points, aggregate, since, start, end)
+    view = "range" if start is not None or end is not None else arg or "day"
+    if view in graph_times:
+        graph_times[view].observe(monotonic() - started_at)
+
+    if request.args.get("format") == "columnar":
+        columns = select_graph_fields(readings, fields)
+        return stream_response(iter_json_columns(readings, columns))
+
+    if fields:
+        columns = select_graph_fields(readings, fields)
+        readings = (
+            {
+                "time": row.get("time"),
+                "ts": row.get("ts"),
+                **{f: row.get(f) for f in columns},
+            }
+            for row in readings
+        )
+    return stream_response(iter_json_array(readings))
+
+
+@app.route("/export", strict_slashes=False)
+def export():
+    _, start, end = get_time_range_args()
+    end_time = datetime.fromtimestamp(end) if end is not None else datetime.now()
+    if start is not None:
+        past_time = datetime.fromtimestamp(start)
+    else:
+        past_time = end_time - timedelta(hours=24)
+    fields = [field for field in request.args.get("fields", "").split(",") if field]
+    if not fields:
+        fields = [key for key in current_readings if key not in ("time", "ts")]
+    if not storage_ready.is_set():
+        return abort(503)
+
+    readings = readings_storage.iter_readings(past_time, end_time)
+    if request.args.get("format") == "ndjson":
+        extension = "ndjson"
+        response = stream_response(
+            iter_export_ndjson(readings, fields), "application/x-ndjson"
+        )
+    else:
+        extension = "csv"
+        response = stream_response(iter_export_csv(readings, fields), "text/csv")
+
+    file_name = (
+        f"enviroplusweb-{past_time.strftime('%Y%m%d%H%M')}"
+        f"-{end_time.strftime('%Y%m%d%H%M')}.{extension}"
+    )
+    response.headers["Content-Disposition"] = f"attachment; filename={file_name}"
+    return response
+
+
+@app.route("/stats", strict_slashes=False)
+def stats():
+    return {
+        "storage": readings_storage.name,
+        "readings_cache": get_readings_cache_stats(),
+        "live_clients": len(readings_subscribers),
+        "startup": dict(startup_times),
+    }
+
+
+@app.route("/metrics", strict_slashes=False)
+def metrics():
+    return Response(get_metrics_text(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/reboot", methods=["POST"])
@@ -609,7 +3010,11 @@ def internal_server_error(e):
     return render_template(app_error_template, error_message=e), 500
 
 
-if __name__ == "__main__":
+startup_times["module"] = round(monotonic() - startup_started_at, 3)
+
+if __name__ == "__main__" and app_role == "sampler":
+    run_sampler()
+elif __name__ == "__main__":
     init_app()
     try:
         app.run(
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+"""
+Project: Enviro Plus Web
+Description: Drivers for the sensors, fan and LCD screen used by Enviro Plus Web
+Author: i.j
+Version: 4.2.0
+URL: https://gitlab.com/idotj/enviroplusweb
+License: GNU
+"""
+
+import random
+import struct
+import threading
+from math import pi, sin
+from time import sleep, time
+
+import numpy as np
+
+
+class PiHardware:
+    name = "pi"
+    sample_rate = 16000
+    duration = 0.5
+    device_names = ("bme280", "ltr559", "noise", "gas", "pms5003")
+
+    def __init__(self):
+        # Devices are opened on first use, so one missing device doesn't block
+        # the others and the app can open them all at once in the background
+        self.devices = {}
+        self.device_locks = {name: threading.Lock() for name in self.device_names}
+        self.gpio = None
+        self.pwm = None
+
+    def get_device(self, name):
+        device = self.devices.get(name)
+        if device is None:
+            with self.device_locks[name]:
+                device = self.devices.get(name)
+                if device is None:
+                    device = getattr(self, f"open_{name}")()
+                    self.devices[name] = device
+        return device
+
+    def open_bme280(self):
+        # The Enviro libraries can only be imported on a Raspberry Pi
+        from smbus2 import SMBus
+        from bme280 import BME280
+
+        return BME280(i2c_dev=SMBus(1))
+
+    def open_ltr559(self):
+        try:
+            from ltr559 import LTR559
+
+            return LTR559()
+        except ImportError:
+            import ltr559
+
+            return ltr559
+
+    def open_noise(self):
+        from enviroplus.noise import Noise
+
+        return Noise(sample_rate=self.sample_rate, duration=self.duration)
+
+    def open_gas(self):
+        from enviroplus import gas
+
+        gas.setup()
+        return gas
+
+    def open_pms5003(self):
+        from pms5003 import PMS5003
+
+        return PMS5003()
+
+    def read_temperature(self):
+        return self.get_device("bme280").get_temperature()
+
+    def read_humidity(self):
+        return self.get_device("bme280").get_humidity()
+
+    def read_pressure(self):
+        return self.get_device("bme280").get_pressure()
+
+    def read_cpu_temperature(self):
+        with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
+            return int(f.read()) / 1000.0
+
+    def read_lux(self):
+        return self.get_device("ltr559").get_lux()
+
+    def read_gas(self):
+        gases = self.get_device("gas").read_all()
+        return gases.oxidising, gases.reducing, gases.nh3
+
+    def read_particles(self):
+        try:
+            particles = self.get_device("pms5003").read()
+        except struct.error as e:
+            raise RuntimeError(f"Invalid frame: {e}") from e
+        return tuple(particles.pm_ug_per_m3(size) for size in (1.0, 2.5, 10))
+
+    def reset_particles(self):
+        self.get_device("pms5003").reset()
+
+    def read_noise_profile(self):
+        return self.get_device("noise").get_noise_profile()
+
+    def open_microphone(self, sample_rate, callback):
+        import sounddevice
+
+        return sounddevice.InputStream(
+            device="adau7002",
+            samplerate=sample_rate,
+            channels=1,
+            dtype="float64",
+            callback=callback,
+        )
+
+    def setup_fan(self, pin):
+        import RPi.GPIO as GPIO
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(pin, GPIO.OUT)
+        self.gpio = GPIO
+        self.pwm = GPIO.PWM(pin, 1000)
+        self.pwm.start(100)
+
+    def set_fan_speed(self, duty_cycle):
+        self.pwm.ChangeDutyCycle(duty_cycle)
+
+    def open_display(self):
+        import st7735
+
+        display = st7735.ST7735(
+            port=0,
+            cs=1,
+            dc="GPIO9",
+            backlight="GPIO12",
+            rotation=270,
+            spi_speed_hz=10000000,
+        )
+        display.begin()
+        return display
+
+    def cleanup(self):
+        if self.gpio is not None:
+            self.gpio.cleanup()
+
+
+class SimulatedMicrophone:
+    def __init__(self, sample_rate, callback, level, block_size=1600):
+        self.sample_rate = sample_rate
+        self.callback = callback
+        self.level = level
+        self.block_size = block_size
+        self.running = False
+        self.thread = threading.Thread(target=self.run, name="microphone")
+        self.thread.daemon = True
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def close(self):
+        pass
+
+    def run(self):
+        block_time = self.block_size / self.sample_rate
+        while self.running:
+            samples = np.random.normal(0, 0.01 * self.level, (self.block_size, 1))
+            self.callback(samples, self.block_size, None, None)
+            sleep(block_time)
+
+
+class SimulatedDisplay:
+    width = 160
+    height = 80
+
+    def __init__(self):
+        self.image = None
+        self.backlight = 1
+
+    def display(self, image):
+        self.image = image
+
+    def set_backlight(self, value):
+        self.backlight = value
+
+
+class SimulatedHardware:
+    name = "simulated"
+    sample_rate = 16000
+    duration = 0.5
+
+    def __init__(self, latency=0.0, noise=1.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.noise = noise
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.fan_speed = None
+
+    def get_device(self, name):
+        # Opening a simulated device takes about as long as reading it
+        self.read_device()
+
+    def read_device(self):
+        if self.latency:
+            sleep(self.latency * self.random.uniform(0.5, 1.5))
+        if self.random.random() < self.failure_rate:
+            raise RuntimeError("Simulated read failure")
+
+    def get_value(self, base, swing, spread):
+        # A daily cycle plus some random noise
+        day_progress = (time() % 86400) / 86400
+        value = base + swing * sin(2 * pi * day_progress)
+        return value + self.random.gauss(0, spread * self.noise)
+
+    def read_temperature(self):
+        self.read_device()
+        return self.get_value(21, 3, 0.2)
+
+    def read_humidity(self):
+        self.read_device()
+        return self.get_value(45, 10, 1)
+
+    def read_pressure(self):
+        self.read_device()
+        return self.get_value(1013, 5, 0.5)
+
+    def read_cpu_temperature(self):
+        return self.get_value(45, 5, 1)
+
+    def read_lux(self):
+        self.read_device()
+        return max(self.get_value(300, 300, 20), 0)
+
+    def read_gas(self):
+        self.read_device()
+        return (
+            max(self.get_value(20000, 5000, 500), 1),
+            max(self.get_value(300000, 50000, 5000), 1),
+            max(self.get_value(100000, 20000, 2000), 1),
+        )
+
+    def read_particles(self):
+        self.read_device()
+        pm1 = max(round(self.get_value(5, 3, 1)), 0)
+        pm25 = pm1 + max(round(self.get_value(3, 2, 1)), 0)
+        pm10 = pm25 + max(round(self.get_value(2, 1, 1)), 0)
+        return pm1, pm25, pm10
+
+    def reset_particles(self):
+        pass
+
+    def read_noise_profile(self):
+        self.read_device()
+        return tuple(abs(self.get_value(0.02, 0.01, 0.005)) for _ in range(4))
+
+    def open_microphone(self, sample_rate, callback):
+        return SimulatedMicrophone(sample_rate, callback, self.noise)
+
+    def setup_fan(self, pin):
+        self.fan_speed = 100
+
+    def set_fan_speed(self, duty_cycle):
+        self.fan_speed = duty_cycle
+
+    def open_display(self):
+        return SimulatedDisplay()
+
+    def cleanup(self):
+        pass
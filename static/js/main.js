@@ -220,14 +220,18 @@ if (particulateSensor) {
 if (openweather) {
   items = { ...items, ...itemsWind };
 }
+const graphFields = Object.keys(items).join(",");
 let firstRun = true;
 let transformedData;
 const frequencies = {
-  day: { reload: 60 },
-  week: { reload: 600 },
-  month: { reload: 1800 },
-  year: { reload: 43200 },
+  hour: { reload: 10, range: 3600 },
+  day: { reload: 60, range: 86400 },
+  week: { reload: 600, range: 604800 },
+  month: { reload: 1800, range: 2592000 },
+  year: { reload: 43200, range: 31536000 },
 };
+// Seconds before asking again for a graph that failed to load
+const graphRetryDelay = 10;
 let frequency;
 let lastFrequency = "";
 let lastGraph = 0;
@@ -283,11 +287,51 @@ const updateHeaderReadings = (dataReadings) => {
     const element = document.getElementById(key);
     const value = dataReadings[key];
     if (element) {
-      element.innerHTML = value !== null ? value : "-";
+      if (value !== null) {
+        element.innerHTML = value;
+      } else {
+        // Sensors not read yet since the app started
+        element.innerHTML = dataReadings.warming_up ? "…" : "-";
+      }
     }
   });
   if (openweather) updateWindDir(dataReadings.windDir);
 };
+
+// Live readings pushed by the server, polling is used when not available
+let readingsStream = null;
+const readingsStreamRetry = 60000;
+
+const connectReadingsStream = () => {
+  if (typeof EventSource === "undefined") return;
+
+  readingsStream = new EventSource("readings/stream");
+  readingsStream.addEventListener("open", () => {
+    if (fanGPIO) setFanSpeed();
+  });
+  readingsStream.addEventListener("message", (event) => {
+    if (activeWindow) updateHeaderReadings(JSON.parse(event.data));
+  });
+  readingsStream.addEventListener("error", () => {
+    readingsStream.close();
+    readingsStream = null;
+    setTimeout(connectReadingsStream, readingsStreamRetry);
+  });
+};
+
+const setFanSpeed = async () => {
+  try {
+    await fetch(`readings?fan=${document.getElementById("fan").value}`);
+  } catch (error) {
+    console.error("Error setting fan speed:", error);
+  }
+};
+
+if (fanGPIO) {
+  document.getElementById("fan").addEventListener("change", () => {
+    if (readingsStream) setFanSpeed();
+  });
+}
 document.getElementById("tempUnits").innerText = unitTemp;
 document.getElementById("presUnits").innerText = unitPres;
 if (openweather) {
@@ -302,45 +346,41 @@ const getGraph = async () => {
     frequency !== lastFrequency ||
     t - lastGraph >= frequencies[frequency].reload
   ) {
+    const isUpdate =
+      frequency === lastFrequency && transformedData && transformedData.length;
     lastFrequency = frequency;
     lastGraph = t;
 
     try {
-      const response = await fetch(`graph?time=${frequency}`);
+      let url = `graph?time=${frequency}&format=columnar&fields=${graphFields}`;
+      const lastTime = isUpdate
+        ? transformedData[transformedData.length - 1].time
+        : null;
+      if (isUpdate) {
+        url += `&since=${lastTime / 1000}`;
+      }
+      const response = await fetch(url);
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const data = await response.json();
       // console.log("getGraph(): ", data);
-      transformedData = data.map((element) => {
-        const result = {
-          time: new Date(element.time).toISOString(),
-          temp: element.temp,
-          humi: element.humi,
-          pres: element.pres,
-          lux: element.lux,
-          ...(openweather && {
-            windDir: element.windDir,
-            windSp: element.windSp,
-          }),
-          high: element.high,
-          mid: element.mid,
-          low: element.low,
-          amp: element.amp,
-          ...(gasSensor && {
-            nh3: element.nh3,
-            red: element.red,
-            oxi: element.oxi,
-          }),
-          ...(particulateSensor && {
-            pm1: element.pm1,
-            pm25: element.pm25,
-            pm10: element.pm10,
-          }),
-        };
+
+      const newData = data.ts.map((ts, index) => {
+        const result = { time: ts * 1000 };
+        Object.keys(items).forEach((key) => {
+          result[key] = data[key] ? data[key][index] : null;
+        });
         return result;
       });
 
+      if (isUpdate) {
+        appendGraphData(newData, lastTime);
+        return;
+      }
+
+      transformedData = newData;
+
       if (!firstRun) {
         destroyAllCharts();
       } else {
@@ -350,10 +390,52 @@ const getGraph = async () => {
       drawGraph(transformedData);
     } catch (error) {
       console.error("Error fetching 'graph' data:", error);
+      // The saved readings may still be loading after the app started
+      lastGraph = t - frequencies[frequency].reload + graphRetryDelay;
     }
   }
 };
 
+const appendGraphData = (newData, lastTime) => {
+  // Charts share the same array, so it's updated in place. The new data starts
+  // with the bucket of the last point, recalculated with the latest readings
+  if (newData.length > 0) {
+    const firstNewTime = Math.min(newData[0].time, lastTime);
+    while (
+      transformedData.length > 0 &&
+      transformedData[transformedData.length - 1].time >= firstNewTime
+    ) {
+      transformedData.pop();
+    }
+    transformedData.push(...newData);
+  }
+
+  const oldestTime = Date.now() - frequencies[frequency].range * 1000;
+  let expired = 0;
+  while (
+    expired < transformedData.length - 1 &&
+    transformedData[expired].time < oldestTime
+  ) {
+    expired++;
+  }
+  if (expired > 0) {
+    transformedData.splice(0, expired);
+  }
+
+  updateAllCharts();
+};
+
+const updateAllCharts = () => {
+  graphChartTemp.update("none");
+  graphChartHumi.update("none");
+  graphChartPres.update("none");
+  graphChartLux.update("none");
+  graphChartNoise.update("none");
+  if (openweather) graphChartWind.update("none");
+  if (gasSensor) graphChartGas.update("none");
+  if (particulateSensor) graphChartPm.update("none");
+};
+
 const destroyAllCharts = () => {
   graphChartTemp.destroy();
   graphChartHumi.destroy();
@@ -382,6 +464,7 @@ const degreesToDirection = (degrees) => {
 
 const drawGraph = (data) => {
   const graphFrequencyMap = {
+    hour: "minute",
     day: "hour",
     week: "day",
     month: "day",
@@ -1075,7 +1158,9 @@ window.addEventListener("resize", function () {
 
 async function init() {
   try {
-    if (activeWindow) await Promise.all([getReadings(), getGraph()]);
+    if (activeWindow) {
+      await Promise.all([readingsStream ? null : getReadings(), getGraph()]);
+    }
   } catch (error) {
     console.error(
       'Error initializing "getReadings" and "getGraph" async function: ',
@@ -1150,4 +1235,5 @@ if (shutdownBtn) {
   });
 }
 
+connectReadingsStream();
 init();
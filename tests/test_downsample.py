@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+
+Config.HARDWARE_BACKEND = "simulated"
+Config.TEMP_CPU_COMPENSATION = False
+
+import enviroplusweb  # noqa: E402
+
+
+def get_readings(count, spike_index):
+    readings = [{"ts": 1000 + i * 2, "pm25": 5.0} for i in range(count)]
+    readings[spike_index]["pm25"] = 80.0
+    return readings
+
+
+@pytest.mark.parametrize("spike_index", [1, 50, 150, 550, 950, 998])
+def test_lttb_keeps_spikes_in_every_bucket(spike_index):
+    readings = get_readings(1000, spike_index)
+    rows = enviroplusweb.downsample_readings(readings, 10, "lttb")
+    spikes = [row for row in rows if row["pm25"] == 80.0]
+    assert len(spikes) == 1
+    assert spikes[0]["pm25Ts"] == readings[spike_index]["ts"]
+
+
+def test_lttb_keeps_first_and_last_readings():
+    readings = get_readings(1000, 500)
+    rows = enviroplusweb.downsample_readings(readings, 10, "lttb")
+    assert len(rows) == 10
+    assert rows[0]["pm25Ts"] == readings[0]["ts"]
+    assert rows[-1]["pm25Ts"] == readings[-1]["ts"]
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Name: benchmark.py
+Author: i.j
+Created: 10/18/26
+Purpose: Measure the storage, graph and live endpoints of Enviro Plus Web
+"""
+
+##
+# Runs the app with simulated sensors inside a temporary folder, fills it with
+# a year of readings and measures:
+#
+#   - the cost of saving a reading as the day file grows
+#   - load_downsample_readings() for every time range, cold and warm
+#   - /graph and /readings throughput with concurrent clients
+#   - peak memory (RSS) of the process
+#
+# Results are printed as JSON, save them with --output and pass them later
+# with --compare to see how a new version performs against the old one.
+#
+#   python3 tools/benchmark.py --output before.json
+#   python3 tools/benchmark.py --compare before.json
+
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+import numpy as np
+
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAPH_RANGES = ["hour", "day", "week", "month", "year"]
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def get_peak_rss():
+    """Peak resident memory of the process, in KB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def get_timings(seconds):
+    """Summary of a list of durations, in milliseconds"""
+    milliseconds = sorted(value * 1000 for value in seconds)
+    return {
+        "count": len(milliseconds),
+        "median_ms": round(statistics.median(milliseconds), 3),
+        "p95_ms": round(milliseconds[math.ceil(len(milliseconds) * 0.95) - 1], 3),
+        "max_ms": round(milliseconds[-1], 3),
+    }
+
+
+def load_app(storage):
+    """Import the app with simulated hardware and the given storage backend"""
+    sys.path.insert(0, APP_FOLDER)
+    from config import Config
+
+    Config.HARDWARE_BACKEND = "simulated"
+    Config.SIMULATED_LATENCY = 0
+    Config.STORAGE_BACKEND = storage
+    Config.DEBUG_LOGGING_ENABLED = False
+    Config.TEMP_CPU_COMPENSATION = False
+
+    import enviroplusweb
+
+    # The app only reads the sensors once its background thread runs
+    for task in enviroplusweb.sensor_tasks:
+        task.update()
+    enviroplusweb.current_readings = enviroplusweb.get_current_readings()
+    return enviroplusweb
+
+
+def generate_history(app, days):
+    """Write `days` of readings, one every 15 minutes, as the app saves them"""
+    fields = [key for key in app.current_readings if key not in ("time", "ts")]
+    end = datetime.now().replace(second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    timestamps = np.arange(start.timestamp(), end.timestamp(), 15 * 60)
+    daily_cycle = np.sin(2 * np.pi * (timestamps % 86400) / 86400)
+
+    values = {}
+    for field in fields:
+        base = abs(app.current_readings[field] or 10)
+        noise = np.random.normal(0, base * 0.05, len(timestamps))
+        values[field] = np.round(base + base * 0.2 * daily_cycle + noise, 1)
+
+    day_records = {}
+    for index, timestamp in enumerate(timestamps.tolist()):
+        record = {"time": time.asctime(time.localtime(timestamp)), "ts": int(timestamp)}
+        record.update((field, values[field][index].item()) for field in fields)
+        day_path = app.get_readings_file_path(datetime.fromtimestamp(timestamp))
+        day_records.setdefault(day_path, []).append(record)
+
+    for day_path, records in day_records.items():
+        app.append_readings_records(day_path, records, sync=False)
+    return len(timestamps)
+
+
+def fill_recent_readings(app):
+    """Fill the in-memory buffer used by the hour graph"""
+    now = time.time()
+    for index in range(app.recent_readings.size):
+        readings = dict(app.current_readings)
+        readings["ts"] = now - (app.recent_readings.size - index) * app.idle_time
+        app.recent_readings.append(readings)
+
+
+def clear_readings_cache(app):
+    with app.readings_cache_lock:
+        app.readings_cache.clear()
+        app.readings_cache_stats["bytes"] = 0
+
+
+def benchmark_save(app, repeat):
+    """Save and flush a reading to storage with growing day files"""
+    results = {}
+    today_path = app.get_readings_file_path(datetime.now())
+    timestamp = int(time.time())
+    for day_size in [0, 96, 960, 9600]:
+        if os.path.exists(today_path):
+            os.remove(today_path)
+        filler = [dict(app.current_readings, ts=timestamp)] * day_size
+        if filler:
+            app.append_readings_records(today_path, filler, sync=False)
+
+        durations = []
+        for _ in range(repeat):
+            timestamp += 1
+            app.current_readings = dict(app.current_readings, ts=timestamp)
+            started_at = time.perf_counter()
+            app.save_readings_file()
+            app.readings_storage.writer.flush()
+            durations.append(time.perf_counter() - started_at)
+        results[str(day_size)] = get_timings(durations)
+        log(f"  save with {day_size} readings in the day: {results[str(day_size)]}")
+    return results
+
+
+def benchmark_graph_loading(app, repeat):
+    """load_downsample_readings() for every range, with and without cache"""
+    results = {}
+    for graph_range in GRAPH_RANGES:
+        cold = []
+        for _ in range(repeat):
+            clear_readings_cache(app)
+            started_at = time.perf_counter()
+            app.load_downsample_readings(graph_range)
+            cold.append(time.perf_counter() - started_at)
+
+        warm = []
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            app.load_downsample_readings(graph_range)
+            warm.append(time.perf_counter() - started_at)
+
+        results[graph_range] = {"cold": get_timings(cold), "warm": get_timings(warm)}
+        log(f"  {graph_range}: {results[graph_range]}")
+    return results
+
+
+def run_clients(url, clients, duration):
+    """Request `url` from several threads at once for `duration` seconds"""
+    durations = []
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            started_at = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    response.read()
+            except Exception:
+                errors.append(1)
+                continue
+            durations.append(time.perf_counter() - started_at)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+
+    result = {
+        "clients": clients,
+        "requests_per_second": round(len(durations) / elapsed, 1),
+        "errors": len(errors),
+    }
+    if durations:
+        result.update(get_timings(durations))
+    return result
+
+
+def benchmark_endpoints(app, clients, duration):
+    """Throughput of the live readings and graph endpoints over HTTP"""
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    results = {}
+    paths = {"readings": "/readings"}
+    paths.update((f"graph_{name}", f"/graph?time={name}") for name in GRAPH_RANGES)
+    try:
+        for name, path in paths.items():
+            results[name] = run_clients(base_url + path, clients, duration)
+            log(f"  {path}: {results[name]}")
+    finally:
+        server.shutdown()
+    return results
+
+
+def flatten(results, prefix=""):
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            values[prefix + key] = value
+    return values
+
+
+def compare_results(previous, current):
+    """Print how each measure changed against a previous run"""
+    previous_values = flatten(previous["results"])
+    current_values = flatten(current["results"])
+    log(f"\nComparison with the run of {previous['date']}:")
+    for key, value in current_values.items():
+        if key not in previous_values or not previous_values[key]:
+            continue
+        if not key.endswith(("_ms", "requests_per_second", "rss_kb", "_seconds")):
+            continue
+        change = (value - previous_values[key]) / previous_values[key] * 100
+        log(f"  {key}: {previous_values[key]} -> {value} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the storage, graph and live endpoints of the app"
+    )
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--days", type=int, default=365, help="history to generate")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per measure")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument(
+        "--duration", type=float, default=5, help="seconds per endpoint"
+    )
+    parser.add_argument("--output", help="file where the results are saved")
+    parser.add_argument("--compare", help="results of a previous run")
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the generated readings folder"
+    )
+    args = parser.parse_args()
+    # The app saves its readings in the working folder, which changes below
+    for name in ("output", "compare"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    work_folder = tempfile.mkdtemp(prefix="enviroplusweb-benchmark-")
+    os.chdir(work_folder)
+    log(f"Working in {work_folder}")
+
+    started_at = time.perf_counter()
+    app = load_app(args.storage)
+    results = {"import_seconds": round(time.perf_counter() - started_at, 3)}
+    app.create_data_folder()
+
+    log(f"Generating {args.days} days of readings...")
+    started_at = time.perf_counter()
+    readings_count = generate_history(app, args.days)
+    results["generate_seconds"] = round(time.perf_counter() - started_at, 3)
+
+    log(f"Opening the {args.storage} storage...")
+    started_at = time.perf_counter()
+    app.readings_storage.open()
+    results["storage_open_seconds"] = round(time.perf_counter() - started_at, 3)
+    app.storage_ready.set()
+    fill_recent_readings(app)
+
+    try:
+        log("Saving readings...")
+        results["save"] = benchmark_save(app, args.repeat)
+        log("Loading graphs...")
+        results["graph_loading"] = benchmark_graph_loading(app, args.repeat)
+        log(f"Requesting endpoints with {args.clients} clients...")
+        results["endpoints"] = benchmark_endpoints(app, args.clients, args.duration)
+    finally:
+        app.readings_storage.close()
+        if not args.keep:
+            shutil.rmtree(work_folder)
+    results["peak_rss_kb"] = get_peak_rss()
+
+    report = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "settings": {**vars(args), "readings": readings_count},
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare_results(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+"""
+Project: Enviro Plus Web
+Description: Entry point to serve Enviro Plus Web with a WSGI server and several workers
+Author: i.j
+Version: 4.2.0
+URL: https://gitlab.com/idotj/enviroplusweb
+License: GNU
+"""
+
+##
+# Only one process can read the sensors, so start the sampler first:
+#
+#   ENVIROPLUSWEB_ROLE=sampler python enviroplusweb.py
+#
+# and then any number of web workers, for example with gunicorn:
+#
+#   gunicorn --workers 3 --threads 8 --bind 0.0.0.0:8080 wsgi:app
+#
+# Don't use --preload, each worker starts its own thread to follow the sampler.
+#
+# Every live readings stream keeps a thread busy, so each worker accepts up to
+# LIVE_UPDATES_MAX_CLIENTS_PER_WORKER of them, keep it below --threads. With
+# gevent (--worker-class gevent) streams don't hold threads and it can be raised.
+
+import os
+
+os.environ.setdefault("ENVIROPLUSWEB_ROLE", "web")
+
+from enviroplusweb import app, init_app  # noqa: E402
+
+init_app()